@@ -0,0 +1,43 @@
+import time
+import tracemalloc
+from src.synthetic import BIN_SIZE, make_session
+
+
+def measure(fn, *args, repeat=5, **kwargs):
+    """
+    Runs fn repeatedly and returns its result along with the best wall time in
+    seconds and the peak memory allocated during a single call in bytes.
+    """
+    tracemalloc.start()
+    result = fn(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+
+    return result, min(times), peak
+
+
+def synthetic_session(num_neurons=200, num_trials=300, num_bins=250, rate=0.05, seed=0):
+    """Synthetic session with Poisson spikes of rate spikes per bin"""
+    return make_session(
+        num_neurons=num_neurons,
+        num_trials=num_trials,
+        num_bins=num_bins,
+        rate_model="constant",
+        rate=rate / BIN_SIZE,
+        visual_gain=0,
+        motor_gain=0,
+        seed=seed,
+    )
+
+
+def print_table(header, rows):
+    widths = [max(len(str(value)) for value in column) for column in zip(header, *rows)]
+    for row in [header, *rows]:
+        print("  ".join(f"{str(value):>{width}}" for value, width in zip(row, widths)))
@@ -0,0 +1,78 @@
+"""
+Compares src.decoding.decode against the original per-trial implementation.
+Run from the app directory with
+
+    python -m benchmarks.decode
+"""
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+from src.data import get_spikes, reshape_by_bins
+from src.decoding import decode
+from .common import measure, print_table, synthetic_session
+
+
+def legacy_decode(clf, spikes, threshold):
+    _, num_trials, num_bins = spikes.shape
+    num_classes = len(np.atleast_1d(threshold)) + 1
+
+    X = reshape_by_bins(spikes)
+    decisions = np.zeros((num_trials, 2), int)
+    posteriors = np.zeros((num_trials, num_bins, num_classes), float)
+    eps = np.finfo(float).eps
+
+    for trial_num in range(num_trials):
+        population_activity = X[
+            (trial_num * num_bins) : ((trial_num + 1) * num_bins), :
+        ]
+        likelihoods = clf.predict_log_proba(population_activity)
+
+        posteriors[trial_num, 0] = likelihoods[0]
+        for i in range(1, num_bins):
+            prob = np.exp(posteriors[trial_num, i - 1] + likelihoods[i]) + eps
+            posteriors[trial_num, i] = np.log(prob / prob.sum())
+        posteriors[trial_num] = np.exp(posteriors[trial_num])
+
+        decision = 0
+        decided = np.argmax(posteriors[trial_num, :, 1:] > threshold, axis=0)
+        if np.any(decided):
+            decision = num_classes - np.argmax(decided[::-1] > 0) - 1
+            decisions[trial_num] = [decision, decided[decision - 1]]
+
+    return decisions, posteriors
+
+
+def main():
+    rows = []
+    for num_classes, num_trials in [(2, 300), (4, 300), (4, 3000)]:
+        session = synthetic_session(num_neurons=100, num_trials=num_trials)
+        labels = np.random.default_rng(0).integers(num_classes, size=num_trials)
+        neurons = np.ones(100, dtype=bool)
+        trials = np.ones(num_trials, dtype=bool)
+        spikes = get_spikes(session, neurons, trials, (0, 100), smoothing=(17, 2.5))
+
+        clf = LogisticRegression(max_iter=200)
+        clf.fit(reshape_by_bins(spikes[:, :, :10]), np.repeat(labels, 10))
+        threshold = np.full(num_classes - 1, 0.6)
+
+        expected, legacy_time, _ = measure(
+            legacy_decode, clf, spikes, threshold, repeat=1
+        )
+        result, new_time, _ = measure(decode, clf, spikes, threshold)
+        assert np.array_equal(expected[0], result[0])
+        assert np.array_equal(expected[1], result[1])
+
+        rows.append(
+            (
+                num_classes,
+                num_trials,
+                f"{legacy_time * 1e3:.1f}",
+                f"{new_time * 1e3:.1f}",
+                f"{legacy_time / new_time:.1f}x",
+            )
+        )
+
+    print_table(("classes", "trials", "legacy ms", "new ms", "speedup"), rows)
+
+
+if __name__ == "__main__":
+    main()
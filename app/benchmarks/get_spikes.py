@@ -0,0 +1,102 @@
+"""
+Compares src.data.get_spikes against the original double fancy-index
+implementation. Run from the app directory with
+
+    python -m benchmarks.get_spikes
+"""
+import numpy as np
+from scipy import signal
+from src.data import get_spikes
+from .common import measure, print_table, synthetic_session
+
+
+def legacy_get_spikes(
+    session, neurons, trials, bins, align=50, baseline_bins=None, smoothing=None
+):
+    all_spikes = session["spks"][neurons][:, trials]
+
+    if smoothing is not None:
+        pad = smoothing[0] // 2
+        bins = np.array(bins) + [-pad, pad]
+
+    bins = np.atleast_1d(align)[:, np.newaxis] + np.arange(*bins)
+    bins += np.minimum(all_spikes.shape[2] - bins[:, -1] - 1, 0)[:, np.newaxis]
+    bins -= np.minimum(bins[:, 0], 0)[:, np.newaxis]
+    bins = bins[np.newaxis, :, :]
+
+    spikes = np.take_along_axis(all_spikes, bins, 2)
+
+    if baseline_bins is not None:
+        start, end = baseline_bins
+        baseline = all_spikes[:, :, start:end]
+        baseline = baseline.mean(axis=2, keepdims=True)
+        spikes = (spikes - baseline) / (baseline + 0.5)
+
+    if smoothing is not None:
+        size, std = smoothing
+        half_gaussian = signal.gaussian(size, std)
+        half_gaussian[size // 2 + 1 :] = 0
+        spikes = signal.convolve(
+            spikes,
+            half_gaussian[np.newaxis, np.newaxis, :],
+            mode="valid",
+            method="direct",
+        )
+
+    return spikes
+
+
+def main():
+    session = synthetic_session(num_neurons=1000, num_trials=300)
+    rng = np.random.default_rng(0)
+    trials = rng.random(300) < 0.5
+    cases = [
+        ("window", dict()),
+        ("baseline", dict(baseline_bins=(0, 50))),
+        ("smoothed", dict(smoothing=(17, 2.5))),
+        ("per-trial align", dict(align=rng.integers(60, 200, trials.sum()))),
+    ]
+
+    rows = []
+    for num_neurons in [50, 200, 1000]:
+        neurons = np.arange(1000) < num_neurons
+        for name, kwargs in cases:
+            args = (session, neurons, trials, (0, 40))
+            expected, legacy_time, legacy_peak = measure(
+                legacy_get_spikes, *args, **kwargs
+            )
+            result, new_time, new_peak = measure(get_spikes, *args, **kwargs)
+            out = np.empty_like(result)
+            _, out_time, out_peak = measure(get_spikes, *args, out=out, **kwargs)
+            assert np.allclose(expected, result) and np.allclose(expected, out)
+
+            rows.append(
+                (
+                    num_neurons,
+                    name,
+                    f"{legacy_time * 1e3:.2f}",
+                    f"{new_time * 1e3:.2f}",
+                    f"{out_time * 1e3:.2f}",
+                    f"{legacy_peak / 2**20:.1f}",
+                    f"{new_peak / 2**20:.1f}",
+                    f"{out_peak / 2**20:.1f}",
+                )
+            )
+
+    print_table(
+        (
+            "neurons",
+            "case",
+            "legacy ms",
+            "new ms",
+            "out= ms",
+            "legacy MiB",
+            "new MiB",
+            "out= MiB",
+        ),
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Measures the cold import time of each module in a fresh interpreter, and
+whether importing it pulls in matplotlib or sklearn.manifold. Run from the app
+directory with
+
+    python -m benchmarks.imports
+"""
+import json
+import subprocess
+import sys
+from pathlib import Path
+from .common import print_table
+
+
+MODULES = [
+    "src.linear",
+    "src.results",
+    "src.data",
+    "src.streaming",
+    "src.decoding",
+    "src.sweep",
+    "src.pca",
+    "src.trajectories",
+    "src.plotting",
+]
+
+HEAVY_MODULES = ["matplotlib", "sklearn.manifold"]
+
+_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps([seconds, [name in sys.modules for name in {heavy!r}]]))
+"""
+
+
+def time_import(module, repeat=3):
+    """
+    Returns the best import time of module in seconds over repeat fresh
+    interpreters, and which of HEAVY_MODULES it imported.
+    """
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", _SCRIPT.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=Path(__file__).parent.parent,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        seconds, imported = json.loads(output.splitlines()[-1])
+        times.append(seconds)
+    return min(times), imported
+
+
+def main():
+    rows = []
+    for module in MODULES:
+        seconds, imported = time_import(module)
+        rows.append(
+            (module, f"{seconds * 1e3:.0f}", *("yes" if i else "" for i in imported))
+        )
+    print_table(("module", "import ms", *HEAVY_MODULES), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Checks that src.linear.LinearDecoder matches the sklearn LogisticRegression it
+was exported from, and compares their prediction times. Run from the app
+directory with
+
+    python -m benchmarks.linear
+"""
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+from src.data import get_spikes, reshape_by_bins
+from src.linear import LinearDecoder
+from .common import measure, print_table, synthetic_session
+
+
+def main():
+    session = synthetic_session(num_neurons=100, num_trials=300)
+    neurons = np.ones(100, dtype=bool)
+    trials = np.ones(300, dtype=bool)
+    X = reshape_by_bins(
+        get_spikes(session, neurons, trials, (0, 100), smoothing=(17, 2.5))
+    )
+
+    rows = []
+    for num_classes in [2, 4]:
+        labels = np.random.default_rng(0).integers(num_classes, size=300)
+        # With "auto", sklearn fits newton-cholesky one-vs-rest even for more
+        # than two classes, which from_sklearn has to pick up
+        for multi_class, solver in [
+            ("ovr", "lbfgs"),
+            ("multinomial", "lbfgs"),
+            ("auto", "newton-cholesky"),
+        ]:
+            clf = LogisticRegression(
+                multi_class=multi_class, solver=solver, max_iter=500
+            )
+            clf.fit(X[::10], np.repeat(labels, 100)[::10])
+            decoder = LinearDecoder.from_arrays(
+                LinearDecoder.from_sklearn(clf).to_arrays()
+            )
+
+            expected, sklearn_time, _ = measure(clf.predict_log_proba, X)
+            result, linear_time, _ = measure(decoder.predict_log_proba, X)
+            assert np.allclose(expected, result)
+            assert np.array_equal(clf.predict(X), decoder.predict(X))
+
+            rows.append(
+                (
+                    num_classes,
+                    multi_class,
+                    solver,
+                    f"{sklearn_time * 1e3:.1f}",
+                    f"{linear_time * 1e3:.1f}",
+                    f"{np.abs(expected - result).max():.1e}",
+                )
+            )
+
+    print_table(
+        ("classes", "multi_class", "solver", "sklearn ms", "linear ms", "max error"),
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
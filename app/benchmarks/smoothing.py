@@ -0,0 +1,61 @@
+"""
+Compares the smoothing backends in src.smoothing against the original direct
+convolution used by get_spikes. Run from the app directory with
+
+    python -m benchmarks.smoothing
+"""
+import numpy as np
+from src.data import get_spikes
+from src.smoothing import exponential_kernel, half_gaussian_kernel, smooth
+from .common import measure, print_table, synthetic_session
+from .get_spikes import legacy_get_spikes
+
+
+def main():
+    session = synthetic_session(num_neurons=100, num_trials=200)
+    neurons = np.ones(100, dtype=bool)
+    trials = np.ones(200, dtype=bool)
+    spikes = get_spikes(session, neurons, trials, (-60, 160), align=60)
+    spikes = spikes.astype(np.float64)
+
+    kernels = [
+        ("half-gaussian (17, 2.5)", half_gaussian_kernel(17, 2.5)),
+        ("half-gaussian (51, 8)", half_gaussian_kernel(51, 8)),
+        ("half-gaussian (101, 15)", half_gaussian_kernel(101, 15)),
+        ("exponential (51, 5)", exponential_kernel(51, 5)),
+    ]
+    rows = []
+    for name, kernel in kernels:
+        expected, direct_time, _ = measure(
+            smooth, spikes, kernel, method="direct", repeat=1
+        )
+        for method in ["ndimage", "shift", "fft", "iir", "auto"]:
+            if method == "iir" and not name.startswith("exponential"):
+                continue
+            result, method_time, _ = measure(smooth, spikes, kernel, method=method)
+            rows.append(
+                (
+                    name,
+                    method,
+                    f"{direct_time * 1e3:.1f}",
+                    f"{method_time * 1e3:.1f}",
+                    f"{direct_time / method_time:.1f}x",
+                    f"{np.abs(result - expected).max():.1e}",
+                )
+            )
+
+    print_table(
+        ("kernel", "method", "direct ms", "method ms", "speedup", "max abs error"),
+        rows,
+    )
+
+    # End to end agreement with the original implementation
+    args = (session, neurons, trials, (0, 100))
+    for smoothing in [(17, 2.5), (51, 8)]:
+        expected = legacy_get_spikes(*args, smoothing=smoothing)
+        result = get_spikes(*args, smoothing=smoothing)
+        assert np.allclose(expected, result), smoothing
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+Benchmarks the data -> decode -> trajectory pipeline on synthetic sessions,
+reporting the time and peak memory of each case and comparing them against a
+stored baseline. Run from the app directory with
+
+    python -m benchmarks.suite [--match get_spikes] [--save] [--check]
+
+--save stores the results as the new baseline, --check exits with an error if
+any case regressed by more than --tolerance.
+"""
+import argparse
+import contextlib
+import io
+import json
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+import numpy as np
+from sklearn.linear_model import LogisticRegression, RidgeClassifier
+from src.data import SESSION_CACHE_DIR, get_spikes, load_sessions, reshape_by_bins
+from src.decoding import cross_validate, cross_validate_windows, decode
+from src.pca import run_pca
+from src.permutation import permutation_test
+from src.selectors import Selectors
+from src.synthetic import make_session, write_sessions
+from src.trajectories import map_and_smooth_conditions
+from .common import measure, print_table
+
+
+BASELINE_FILE = Path(__file__).parent / "baseline.json"
+
+BENCHMARKS = []
+
+
+def benchmark(name, **params):
+    """
+    Decorator registering a benchmark case. The decorated function is called
+    with params and returns the function to time, which takes no arguments.
+    """
+
+    def decorator(setup):
+        BENCHMARKS.append((name, params, setup))
+        return setup
+
+    return decorator
+
+
+_tmp_dir = None
+
+
+def _data_dir():
+    # A small synthetic dataset, written once per run
+    global _tmp_dir
+    if _tmp_dir is None:
+        _tmp_dir = tempfile.TemporaryDirectory()
+        _quiet(
+            lambda: write_sessions(
+                _tmp_dir.name, num_sessions=6, sessions_per_file=2, num_neurons=300
+            )
+        )()
+    return Path(_tmp_dir.name)
+
+
+def _quiet(fn):
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fn()
+
+    return run
+
+
+def _load_sessions(cache):
+    data_dir = _data_dir()
+
+    def run():
+        if cache == "cold":
+            shutil.rmtree(data_dir / SESSION_CACHE_DIR, ignore_errors=True)
+        return load_sessions(data_dir)
+
+    run = _quiet(run)
+    if cache == "warm":
+        run()
+    return run
+
+
+for cache in ["cold", "warm"]:
+    benchmark("load_sessions", cache=cache)(_load_sessions)
+
+
+def _get_spikes(neurons, smoothing):
+    session = make_session(num_neurons=neurons, num_trials=300, seed=0)
+    neurons = np.ones(neurons, dtype=bool)
+    trials = np.ones(300, dtype=bool)
+    return lambda: get_spikes(session, neurons, trials, (0, 100), smoothing=smoothing)
+
+
+for num_neurons in [100, 400, 1000]:
+    for smoothing in [None, (17, 2.5), (61, 10)]:
+        benchmark("get_spikes", neurons=num_neurons, smoothing=smoothing)(_get_spikes)
+
+
+def _decoding_data(num_classes, num_trials, num_bins):
+    session = make_session(num_neurons=100, num_trials=num_trials, seed=0)
+    neurons = np.ones(100, dtype=bool)
+    trials = np.ones(num_trials, dtype=bool)
+    spikes = get_spikes(session, neurons, trials, (0, num_bins), smoothing=(17, 2.5))
+    labels = np.random.default_rng(0).integers(num_classes, size=num_trials)
+    return spikes, labels
+
+
+def _cross_validate(n_jobs):
+    spikes, labels = _decoding_data(2, 200, 20)
+    clf = LogisticRegression(max_iter=200, random_state=0)
+    return lambda: cross_validate(clf, spikes, labels, n_jobs=n_jobs)
+
+
+for n_jobs in [1, 4]:
+    benchmark("cross_validate", n_jobs=n_jobs)(_cross_validate)
+
+
+def _cross_validate_windows(warm_start):
+    spikes, labels = _decoding_data(2, 200, 100)
+    clf = LogisticRegression(max_iter=200, random_state=0)
+    return lambda: cross_validate_windows(
+        clf, spikes, labels, window=10, warm_start=warm_start
+    )
+
+
+for warm_start in [False, True]:
+    benchmark("cross_validate_windows", warm_start=warm_start)(_cross_validate_windows)
+
+
+@benchmark("permutation_test", permutations=200)
+def _permutation_test(permutations):
+    spikes, labels = _decoding_data(2, 200, 20)
+    clf = RidgeClassifier(alpha=10.0)
+    return lambda: permutation_test(
+        clf, spikes, labels, num_permutations=permutations, seed=0
+    )
+
+
+def _decode(classes):
+    spikes, labels = _decoding_data(classes, 300, 100)
+    clf = LogisticRegression(max_iter=200)
+    clf.fit(reshape_by_bins(spikes[:, :, :10]), np.repeat(labels, 10))
+    return lambda: decode(clf, spikes, np.full(classes - 1, 0.6))
+
+
+for num_classes in [2, 4]:
+    benchmark("decode", classes=num_classes)(_decode)
+
+
+def _run_pca(method):
+    dat = make_session(num_neurons=300, num_trials=200, seed=0)["spks"][:, :, 50:130]
+    n_components = None if method == "full" else 10
+    return lambda: run_pca(
+        dat, method=method, n_components=n_components, random_state=0
+    )
+
+
+for method in ["full", "randomized", "covariance"]:
+    benchmark("run_pca", method=method)(_run_pca)
+
+
+@benchmark("map_and_smooth", conditions=4)
+def _map_and_smooth(conditions):
+    session = make_session(num_neurons=200, num_trials=300, seed=0)
+    W, V, _ = run_pca(session["spks"][:, :, 50:130], method="covariance")
+    masks = np.arange(300) % conditions == np.arange(conditions)[:, np.newaxis]
+    data = {i: session["spks"][:, mask] for i, mask in enumerate(masks)}
+    return lambda: map_and_smooth_conditions(data, W, V)
+
+
+@benchmark("get_selectors", trials=300)
+def _get_selectors(trials):
+    session = make_session(num_neurons=200, num_trials=trials, seed=0)
+    # A fresh Selectors each time, to time computing every selector
+    return lambda: {name: value for name, value in Selectors(session).items()}
+
+
+def _case_name(name, params):
+    return " ".join([name, *(f"{key}={value}" for key, value in params.items())])
+
+
+def run(match=None, repeat=3):
+    """Runs the benchmarks whose name contains match, returning their results"""
+    results = {}
+    for name, params, setup in BENCHMARKS:
+        case = _case_name(name, params)
+        if match is not None and match not in case:
+            continue
+        _, seconds, peak = measure(setup(**params), repeat=repeat)
+        results[case] = {"seconds": seconds, "peak_bytes": peak}
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns table rows comparing results to the baseline, and the names of the
+    cases that are slower or use more memory than the baseline by more than
+    tolerance (a fraction).
+    """
+    rows, regressions = [], []
+    for case, result in results.items():
+        row = [
+            case,
+            f"{result['seconds'] * 1e3:.1f}",
+            f"{result['peak_bytes'] / 1e6:.1f}",
+        ]
+        if case not in baseline:
+            rows.append(row + ["", ""])
+            continue
+
+        time_ratio = result["seconds"] / baseline[case]["seconds"]
+        memory_ratio = result["peak_bytes"] / max(baseline[case]["peak_bytes"], 1)
+        if time_ratio > 1 + tolerance or memory_ratio > 1 + tolerance:
+            regressions.append(case)
+        rows.append(row + [f"{time_ratio:.2f}x", f"{memory_ratio:.2f}x"])
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--match", help="only run cases containing this string")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    parser.add_argument("--save", action="store_true", help="save as the baseline")
+    parser.add_argument("--check", action="store_true", help="fail on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = run(match=args.match, repeat=args.repeat)
+
+    baseline = {}
+    if args.baseline.exists():
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    rows, regressions = compare(results, baseline, args.tolerance)
+    print_table(("case", "ms", "peak MB", "time vs base", "memory vs base"), rows)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump({**baseline, **results}, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.baseline}")
+
+    if regressions:
+        print(f"Regressions: {', '.join(regressions)}")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
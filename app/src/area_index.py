@@ -0,0 +1,146 @@
+import numpy as np
+import os
+from . import brain_areas
+
+
+AREA_INDEX_FILE = "areas.npz"
+
+
+def get_area_groups():
+    """Returns the AREAS_* lists of brain_areas by group name, e.g. VISUAL"""
+    return {
+        name[len("AREAS_") :]: list(areas)
+        for name, areas in vars(brain_areas).items()
+        if name.startswith("AREAS_")
+    }
+
+
+class AreaIndex:
+    """
+    Inverted index from brain area to the sessions and neurons recording from it,
+    so that area queries don't need to scan every session's brain_area.
+
+    Arguments:
+    brain_areas -- dict of each session's brain_area array by session number
+    """
+
+    def __init__(self, brain_areas):
+        self.groups = get_area_groups()
+        self._brain_areas = {
+            int(session): np.asarray(areas).astype(str)
+            for session, areas in brain_areas.items()
+        }
+        self._neurons = {}
+        for session, areas in self._brain_areas.items():
+            order = np.argsort(areas, kind="stable")
+            names, starts = np.unique(areas[order], return_index=True)
+            for name, neurons in zip(names, np.split(order, starts[1:])):
+                self._neurons.setdefault(str(name), {})[session] = neurons
+        self._counts = {
+            area: {session: len(neurons) for session, neurons in sessions.items()}
+            for area, sessions in self._neurons.items()
+        }
+
+    def __repr__(self):
+        return f"AreaIndex(areas={len(self.areas)}, sessions={len(self.sessions)})"
+
+    @property
+    def areas(self):
+        return sorted(self._neurons)
+
+    @property
+    def sessions(self):
+        return sorted(self._brain_areas)
+
+    def _expand(self, areas):
+        # Group names expand into their areas, whether given alone or in a list
+        if isinstance(areas, str):
+            areas = [areas] if areas else []
+        expanded = []
+        for area in areas:
+            if area not in self._neurons:
+                expanded.extend(self.groups.get(area.upper(), []))
+            else:
+                expanded.append(area)
+        return [area for area in dict.fromkeys(expanded) if area in self._neurons]
+
+    def counts(self, areas):
+        """
+        Returns the number of neurons recording from areas in each session that
+        has any.
+
+        Arguments:
+        areas -- area name (e.g. VISp), group name (e.g. VISUAL) or list of
+            either
+        """
+        counts = {}
+        for area in self._expand(areas):
+            for session, count in self._counts[area].items():
+                counts[session] = counts.get(session, 0) + count
+        return counts
+
+    def neurons(self, areas, session):
+        """Returns the sorted indices of the session's neurons in areas"""
+        neurons = [
+            self._neurons[area][session]
+            for area in self._expand(areas)
+            if session in self._neurons[area]
+        ]
+        if not neurons:
+            return np.array([], dtype=int)
+        return np.sort(np.concatenate(neurons))
+
+    def sessions_with(self, *areas, min_neurons=1):
+        """
+        Returns the sessions recording from all of the given areas, with their
+        neuron count in each, e.g. sessions_with("VISp", "MOs") or
+        sessions_with("VISUAL", "MOTOR").
+
+        Arguments:
+        areas -- area names, group names or lists of either
+
+        Keyword Arguments:
+        min_neurons -- minimum number of neurons in each of the areas
+        """
+        all_counts = [self.counts(area) for area in areas]
+        if not all_counts:
+            return {}
+        sessions = set.intersection(
+            *(
+                {session for session, count in counts.items() if count >= min_neurons}
+                for counts in all_counts
+            )
+        )
+        return {
+            session: tuple(counts[session] for counts in all_counts)
+            for session in sorted(sessions)
+        }
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            sessions=np.array(sorted(self._brain_areas), dtype=int),
+            **{f"brain_area_{s}": areas for s, areas in self._brain_areas.items()},
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls({s: f[f"brain_area_{s}"] for s in f["sessions"]})
+
+
+def load_area_index(cache_dir, sessions):
+    """
+    Returns the AreaIndex stored in the session cache, building and storing it
+    from the sessions' brain_area fields if it doesn't exist yet.
+    """
+    path = cache_dir / AREA_INDEX_FILE
+    if path.exists():
+        return AreaIndex.load(path)
+
+    index = AreaIndex({session.number: session["brain_area"] for session in sessions})
+    if cache_dir.exists():
+        index.save(path)
+    return index
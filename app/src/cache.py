@@ -0,0 +1,233 @@
+import hashlib
+import numpy as np
+import os
+from collections import OrderedDict
+from pathlib import Path
+from .data import get_spikes
+from .pca import run_pca
+from .smoothing import get_kernel
+
+
+def cache_key(*parts):
+    """Hashes strings, numbers, tuples and arrays into a hex digest"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (np.ndarray, list)):
+            part = np.ascontiguousarray(part)
+            digest.update(f"{part.dtype.str}{part.shape}".encode())
+            digest.update(part.tobytes())
+        else:
+            digest.update(repr(part).encode())
+        digest.update(b"|")
+    return digest.hexdigest()
+
+
+class ArrayCache:
+    """
+    Content-addressed cache of arrays.
+
+    Arrays are stored on disk as <key>.npy files and read back memory-mapped, so
+    cached arrays are read-only. The least recently used files are deleted once
+    the cache grows beyond max_bytes. Recently used arrays are also kept in an
+    in-process LRU of up to memory_bytes.
+
+    Arguments:
+    cache_dir -- directory to store arrays in
+
+    Keyword Arguments:
+    max_bytes -- size limit of the on-disk cache, None for unbounded
+    memory_bytes -- size limit of the in-process cache
+    """
+
+    def __init__(self, cache_dir, max_bytes=None, memory_bytes=1 << 30):
+        if type(cache_dir) is str:
+            cache_dir = Path(cache_dir)
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self._memory = OrderedDict()
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.npy"
+
+    def _remember(self, key, array):
+        self._memory[key] = array
+        self._memory.move_to_end(key)
+        total = sum(array.nbytes for array in self._memory.values())
+        while total > self.memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            total -= evicted.nbytes
+
+    def __contains__(self, key):
+        return key in self._memory or os.path.isfile(self._path(key))
+
+    def get(self, key):
+        """Returns the cached array, or None if it isn't cached"""
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+
+        path = self._path(key)
+        try:
+            array = np.load(path, mmap_mode="r")
+            # Access time is often disabled, so track recency with mtime
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        self._remember(key, array)
+        return array
+
+    def put(self, key, array):
+        path = self._path(key)
+        # The temp name doesn't end in .npy, so _evict and clear never see a
+        # partly written file, and np.save gets a file object so it doesn't add it
+        tmp_path = self.cache_dir / f"{key}.{os.getpid()}.npy.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+        self._evict()
+        return self.get(key)
+
+    def get_or_compute(self, key, compute):
+        array = self.get(key)
+        if array is None:
+            array = self.put(key, compute())
+        return array
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+
+        entries = []
+        for path in self.cache_dir.glob("*.npy"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            self._memory.pop(path.stem, None)
+            total -= size
+
+    def clear(self):
+        self._memory.clear()
+        for path in self.cache_dir.glob("*.npy"):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class SpikeCache(ArrayCache):
+    """
+    ArrayCache of get_spikes outputs, keyed by the session and every argument
+    of get_spikes.
+    """
+
+    def key(self, session, neurons, trials, bins, session_key=None, **kwargs):
+        if session_key is None:
+            session_key = getattr(session, "key", None)
+        if session_key is None:
+            raise ValueError("session_key is required for sessions not from the cache")
+
+        smoothing = kwargs.get("smoothing")
+        return cache_key(
+            "spikes",
+            session_key,
+            np.asarray(neurons),
+            np.asarray(trials),
+            tuple(bins),
+            np.atleast_1d(kwargs.get("align", 50)),
+            kwargs.get("baseline_bins"),
+            None if smoothing is None else get_kernel(smoothing),
+            kwargs.get("smoothing_method", "auto"),
+        )
+
+    def get_spikes(self, session, neurons, trials, bins, session_key=None, **kwargs):
+        """
+        Cached get_spikes. session_key identifies the session and is only
+        needed for plain session dicts.
+        """
+        key = self.key(
+            session, neurons, trials, bins, session_key=session_key, **kwargs
+        )
+        return self.get_or_compute(
+            key, lambda: get_spikes(session, neurons, trials, bins, **kwargs)
+        )
+
+
+class PCACache(ArrayCache):
+    """
+    ArrayCache of run_pca outputs, fit on the spikes of a session's neurons,
+    trials (e.g. a condition) and bins, keyed like SpikeCache by the session
+    and every argument.
+    """
+
+    def key(self, session, neurons, trials=None, bins=None, session_key=None, **kwargs):
+        if session_key is None:
+            session_key = getattr(session, "key", None)
+        if session_key is None:
+            raise ValueError("session_key is required for sessions not from the cache")
+
+        return cache_key(
+            "pca",
+            session_key,
+            np.asarray(neurons),
+            None if trials is None else np.asarray(trials),
+            None if bins is None else tuple(bins),
+            tuple(sorted(kwargs.items())),
+        )
+
+    def run_pca(
+        self, session, neurons, trials=None, bins=None, session_key=None, **kwargs
+    ):
+        """
+        Cached run_pca(session["spks"][neurons][:, trials, bins[0]:bins[1]]),
+        returning W, V and variance_explained.
+
+        Arguments:
+        session -- session to fit the PCA on
+        neurons -- neuron selector
+
+        Keyword Arguments:
+        trials -- trial selector, None for all trials
+        bins -- (start, stop) bins to fit on, None for all bins
+        session_key -- identifies the session, only needed for plain session dicts
+        kwargs -- passed to run_pca, e.g. method and n_components
+        """
+
+        def compute():
+            # get_spikes also extracts windows of sparse spikes
+            _, num_trials, num_bins = session["spks"].shape
+            dat = get_spikes(
+                session,
+                neurons,
+                np.arange(num_trials) if trials is None else trials,
+                (0, num_bins) if bins is None else bins,
+                align=0,
+            )
+            W, V, variance_explained = run_pca(dat, **kwargs)
+            # Stored as one array of PCs x (neurons + 2)
+            return np.column_stack([W, V, variance_explained])
+
+        key = self.key(
+            session,
+            neurons,
+            trials=trials,
+            bins=bins,
+            session_key=session_key,
+            **kwargs,
+        )
+        array = self.get_or_compute(key, compute)
+        return array[:, :-2], array[:, -2], array[:, -1]
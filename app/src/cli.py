@@ -0,0 +1,140 @@
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+from .sweep import TASKS, get_job_name, make_jobs, run_sweep
+
+
+def parse_sessions(value):
+    """Parses session numbers like "11,12" or "0-4,20" into a list"""
+    sessions = []
+    for part in value.split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            sessions.extend(range(int(start), int(end) + 1))
+        elif part:
+            sessions.append(int(part))
+    return sessions
+
+
+def parse_list(value):
+    return [item for item in value.split(",") if item]
+
+
+def run_decoders(args):
+    """
+    Runs the decoder sweep for the given sessions, areas and tasks, printing
+    progress and per-stage timings as jobs finish. Returns 1 if any job failed.
+    """
+    data_dir = Path(args.data_dir)
+    sessions = args.sessions
+    if sessions is None:
+        from .data import load_sessions
+
+        sessions = list(load_sessions(data_dir).numbers)
+
+    jobs = make_jobs(sessions, args.areas, tasks=args.tasks)
+    print(f"Running {len(jobs)} jobs with {args.jobs or os.cpu_count()} workers...")
+
+    start = time.perf_counter()
+    totals = {}
+    num_done = 0
+    failed = []
+    for job, result in run_sweep(
+        data_dir,
+        jobs,
+        n_jobs=args.jobs,
+        skip_complete=not args.overwrite,
+        max_bytes=args.max_bytes,
+        cache_bytes=args.cache_bytes,
+    ):
+        num_done += 1
+        progress = f"[{num_done}/{len(jobs)}] session {job.session} {get_job_name(job)}"
+        if result is None:
+            print(f"{progress}: no neurons")
+            continue
+        if "error" in result:
+            failed.append(job)
+            print(f"{progress}: failed\n{result['error']}")
+            continue
+
+        timings = result["timings"]
+        for stage, seconds in timings.items():
+            totals[stage] = totals.get(stage, 0) + seconds
+        stages = ", ".join(
+            f"{stage} {seconds:.1f}s" for stage, seconds in timings.items()
+        )
+        print(f"{progress}: {stages}")
+
+    elapsed = time.perf_counter() - start
+    print(f"Ran {num_done} jobs in {elapsed:.1f}s")
+    if totals:
+        print(
+            "Total time by stage: "
+            + ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in totals.items())
+        )
+    if num_done < len(jobs):
+        print(f"Skipped {len(jobs) - num_done} jobs with saved results or no neurons")
+    if failed:
+        print(f"{len(failed)} jobs failed:")
+        for job in failed:
+            print(f"  session {job.session} {get_job_name(job)}")
+    return 1 if failed else 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m src", description="Steinmetz decoder analyses"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    decoders = commands.add_parser(
+        "run-decoders", help="fit and run decoders, saving their results"
+    )
+    decoders.add_argument(
+        "--data-dir",
+        default=os.environ.get(
+            "DATA_DIR", Path(__file__).parent.parent.parent / "data"
+        ),
+        help="directory holding the sessions and decoder results",
+    )
+    decoders.add_argument(
+        "--sessions",
+        type=parse_sessions,
+        help="session numbers, e.g. 11,12 or 0-38 (defaults to all)",
+    )
+    decoders.add_argument(
+        "--areas",
+        type=parse_list,
+        default=["VISUAL", "MOTOR"],
+        help="area groups from brain_areas, e.g. VISUAL,MOTOR",
+    )
+    decoders.add_argument(
+        "--tasks",
+        type=parse_list,
+        default=list(TASKS),
+        help=f"decoding tasks, any of {','.join(TASKS)}",
+    )
+    decoders.add_argument(
+        "--jobs", type=int, help="number of worker processes (defaults to all CPUs)"
+    )
+    decoders.add_argument(
+        "--max-bytes", type=int, help="per-worker budget for loaded session data"
+    )
+    decoders.add_argument(
+        "--cache-bytes",
+        type=int,
+        help="size limit of the cache of extracted spikes, 0 disables it",
+    )
+    decoders.add_argument(
+        "--overwrite", action="store_true", help="rerun jobs with saved results"
+    )
+    decoders.set_defaults(func=run_decoders)
+
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    sys.exit(args.func(args))
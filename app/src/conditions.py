@@ -0,0 +1,121 @@
+import numpy as np
+from .data import get_spikes
+from .selectors import get_selectors
+from .sparse import as_indices
+
+
+def get_condition_masks(session, conditions, selector=None):
+    """
+    Returns the condition names and a conditions x trials boolean array.
+
+    Arguments:
+    session -- session the conditions are of
+    conditions -- selector names or expressions (e.g. "STIM_LEFT & CHOICE_CORRECT"),
+        or a dict of trial masks by condition name
+
+    Keyword Arguments:
+    selector -- selectors of the session, defaults to get_selectors(session)
+    """
+    if not isinstance(conditions, dict):
+        if selector is None:
+            selector = get_selectors(session)
+        conditions = {name: selector[name] for name in conditions}
+    names = list(conditions)
+    return names, np.stack([np.asarray(conditions[name], bool) for name in names])
+
+
+def get_condition_stats(
+    session,
+    neurons,
+    conditions,
+    bins=None,
+    align=50,
+    selector=None,
+    chunk_size=64,
+    **kwargs,
+):
+    """
+    Computes the trial-averaged spikes, trial counts and across-trial variances
+    of several conditions in a single pass over the spike tensor.
+
+    Trials are summed into every condition at once by multiplying with a
+    conditions x trials indicator matrix, a chunk of neurons at a time, instead
+    of copying out and averaging each condition's trials separately. Trials
+    can belong to several conditions. Squares are summed in the same pass, after
+    shifting each neuron and bin by its mean over trials so that the variances
+    don't lose precision to cancellation.
+
+    Arguments:
+    session -- session dict or Session
+    neurons -- boolean mask or indices of neurons, or a selector name such as
+        "NEURON_VISUAL"
+    conditions -- selector names or expressions, or a dict of trial masks by
+        condition name (see get_condition_masks)
+
+    Keyword Arguments:
+    bins -- (start, end) of the window relative to align, defaults to all bins
+        for a scalar align. As in get_spikes, windows past either end of the
+        session are shifted to fit inside it.
+    align -- bin to align the window to, either a scalar or one per trial of
+        the session, as in get_spikes
+    selector -- selectors of the session, defaults to get_selectors(session)
+    chunk_size -- number of neurons per chunk
+    kwargs -- passed to get_spikes, e.g. smoothing or baseline_bins
+
+    Returns the condition names and arrays of means and variances of shape
+    (conditions, neurons, bins) and counts of shape (conditions,). Conditions
+    without trials have NaN means and variances.
+    """
+    if selector is None:
+        selector = get_selectors(session)
+    if isinstance(neurons, str):
+        neurons = selector[neurons]
+    neurons = as_indices(neurons)
+    if bins is None:
+        if np.ndim(align) > 0:
+            raise ValueError("bins are required with a per-trial align")
+        bins = (-align, session["spks"].shape[2] - align)
+
+    names, masks = get_condition_masks(session, conditions, selector=selector)
+    counts = masks.sum(axis=1)
+    all_spikes = session["spks"]
+    # Plain windows of dense spikes are sliced directly, otherwise get_spikes
+    # extracts the trials that belong to any condition
+    is_slice = isinstance(all_spikes, np.ndarray) and np.ndim(align) == 0 and not kwargs
+    num_bins = bins[1] - bins[0]
+    if is_slice:
+        trials = slice(None)
+        # Same clamping as get_spikes
+        first_bin = align + bins[0]
+        first_bin += min(all_spikes.shape[2] - first_bin - num_bins, 0)
+        first_bin -= min(first_bin, 0)
+    else:
+        trials = np.flatnonzero(masks.any(axis=0))
+        if np.ndim(align) > 0:
+            align = np.asarray(align)[trials]
+
+    # Conditions without trials divide by zero into NaN
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weights = masks[:, trials] / counts[:, np.newaxis]
+    means = np.empty((len(names), len(neurons), num_bins))
+    variances = np.empty_like(means)
+    for start in range(0, len(neurons), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        if is_slice:
+            spikes = all_spikes[neurons[chunk], :, first_bin : first_bin + num_bins]
+        else:
+            spikes = get_spikes(
+                session, neurons[chunk], trials, bins, align=align, **kwargs
+            )
+        spikes = spikes.astype(np.float64)
+        reference = spikes.mean(axis=1, keepdims=True)
+        spikes -= reference
+        # (conditions, trials) @ (neurons, trials, bins) -> (neurons, conditions, bins)
+        shifted_means = np.matmul(weights, spikes)
+        spikes **= 2
+        shifted_squares = np.matmul(weights, spikes)
+        means[:, chunk] = (shifted_means + reference).transpose(1, 0, 2)
+        variances[:, chunk] = (shifted_squares - shifted_means ** 2).transpose(1, 0, 2)
+    np.maximum(variances, 0, out=variances)
+
+    return names, means, counts, variances
@@ -1,38 +1,305 @@
+import hashlib
+import json
 import numpy as np
 import os
-import pickle
 import requests
 import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from scipy import signal
+from .area_index import AREA_INDEX_FILE, AreaIndex
+from .results import open_results
+from .sessions import SessionCollection
+from .smoothing import get_kernel, smooth
+from .sparse import SparseSpikes, as_indices
 
 
 SESSION_FILE_NAME = "steinmetz_part"
+SESSION_CACHE_DIR = "sessions"
+SESSION_INDEX_FILE = "index.json"
+SESSION_CACHE_VERSION = 1
+SESSION_MANIFEST_FILE = "steinmetz.sha256"
+SESSION_URLS = [
+    "https://osf.io/agvxh/download",
+    "https://osf.io/uv3mw/download",
+    "https://osf.io/ehmw2/download",
+]
+DOWNLOAD_CHUNK_SIZE = 1 << 20
 
 
-def download_sessions(data_dir):
+def _sha256(file_path, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_manifest(manifest_file):
+    """Reads a sha256sum-style manifest into a dict of file name -> digest"""
+    if not os.path.isfile(manifest_file):
+        return {}
+    with open(manifest_file, "r") as f:
+        lines = [line.split() for line in f if line.strip()]
+    return {name.lstrip("*"): digest for digest, name in lines}
+
+
+def write_manifest(manifest_file, checksums):
+    with open(f"{manifest_file}.tmp", "w") as f:
+        for name, digest in sorted(checksums.items()):
+            f.write(f"{digest}  {name}\n")
+    os.replace(f"{manifest_file}.tmp", manifest_file)
+
+
+def download_file(url, file_path, sha256=None, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """
+    Streams url to file_path in chunks.
+
+    Data is written to a .part file next to file_path, and an existing .part
+    file from an interrupted download is resumed with an HTTP Range request. The
+    file is only renamed into place once it is complete and, if sha256 is given,
+    its checksum matches. A .part file the server reports as already complete is
+    checked against the size in its Content-Range.
+
+    Returns the SHA-256 digest of the downloaded file.
+    """
+    part_path = file_path.with_name(f"{file_path.name}.part")
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+
+    with requests.get(url, headers=headers, stream=True, timeout=60) as r:
+        if r.status_code == requests.codes.requested_range_not_satisfiable:
+            # The previous attempt may already have received the whole file, which
+            # the server confirms with a Content-Range of "bytes */<size>"
+            content_range = r.headers.get("Content-Range", "")
+            total_size = content_range.rpartition("/")[2]
+            if total_size.isdigit() and int(total_size) != offset:
+                part_path.unlink()
+                raise requests.ConnectionError(
+                    f"Partial download of {url} has {offset} of {total_size} bytes"
+                )
+            if not total_size.isdigit() and sha256 is None:
+                raise requests.ConnectionError(
+                    f"Can't tell whether the partial download of {url} is complete"
+                )
+        elif r.status_code in (requests.codes.ok, requests.codes.partial_content):
+            if r.status_code == requests.codes.ok:
+                # Server ignored the Range header, start over
+                offset = 0
+            expected_size = r.headers.get("Content-Length")
+            written = 0
+            with open(part_path, "ab" if offset > 0 else "wb") as f:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    written += len(chunk)
+            if expected_size is not None and written != int(expected_size):
+                raise requests.ConnectionError(
+                    f"Incomplete download of {url}: {written} of {expected_size} bytes"
+                )
+        else:
+            raise requests.ConnectionError(
+                f"Failed to download {url}: HTTP {r.status_code}"
+            )
+
+    digest = _sha256(part_path)
+    if sha256 is not None and digest != sha256:
+        part_path.unlink()
+        raise ValueError(f"Checksum mismatch for {file_path}")
+
+    os.replace(part_path, file_path)
+    return digest
+
+
+def download_sessions(data_dir, urls=SESSION_URLS, checksums=None, jobs=None):
+    """
+    Downloads the session archives that aren't already in data_dir.
+
+    Archives are fetched concurrently, resuming any interrupted downloads, and
+    verified against the SHA-256 digests in checksums. Digests of newly
+    downloaded archives are added to the manifest in data_dir, so a later
+    download of the same archive is checked against it.
+
+    Keyword Arguments:
+    urls -- archive URLs, archive i is saved as steinmetz_part<i>.npz
+    checksums -- dict of file name -> SHA-256 digest, defaults to the manifest
+    jobs -- number of concurrent downloads, defaults to one per archive
+    """
     if type(data_dir) is str:
         data_dir = Path(data_dir)
+    os.makedirs(data_dir, exist_ok=True)
 
-    urls = [
-        "https://osf.io/agvxh/download",
-        "https://osf.io/uv3mw/download",
-        "https://osf.io/ehmw2/download",
-    ]
+    manifest_file = data_dir / SESSION_MANIFEST_FILE
+    manifest = read_manifest(manifest_file)
+    if checksums is None:
+        checksums = manifest
+
+    downloads = {}
     for i, url in enumerate(urls):
         file_path = data_dir / f"{SESSION_FILE_NAME}{i}.npz"
         if os.path.isfile(file_path):
             continue
+        if file_path.name not in checksums:
+            print(f"No known checksum for {file_path.name}, it won't be verified")
+        downloads[file_path] = url
+
+    if len(downloads) == 0:
+        return
+
+    with ThreadPoolExecutor(max_workers=jobs or len(downloads)) as executor:
+        futures = {
+            executor.submit(
+                download_file, url, file_path, sha256=checksums.get(file_path.name)
+            ): file_path
+            for file_path, url in downloads.items()
+        }
+        errors = []
+        for future in as_completed(futures):
+            file_path = futures[future]
+            try:
+                manifest[file_path.name] = future.result()
+                print(f"Downloaded {file_path}")
+            except (requests.RequestException, ValueError) as e:
+                errors.append(e)
+
+    write_manifest(manifest_file, manifest)
+    if len(errors) > 0:
+        raise errors[0]
+
+
+def _get_source_info(files):
+    return [
+        {"name": f.name, "size": f.stat().st_size, "mtime": int(f.stat().st_mtime)}
+        for f in files
+    ]
+
+
+def _split_fields(session):
+    fields, attrs = {}, {}
+    for key, value in session.items():
+        if not isinstance(value, np.ndarray) or value.ndim == 0:
+            attrs[key] = value.item() if isinstance(value, np.generic) else value
+            continue
+        if value.dtype == object and all(isinstance(v, str) for v in value.flat):
+            value = value.astype(str)
+        fields[key] = value
+    return fields, attrs
+
+
+def build_session_cache(data_dir, files=None, cache_dir=None):
+    """
+    Converts the pickled session archives into an on-disk cache with one raw
+    .npy file per session field, which can then be memory-mapped.
+
+    The cache is laid out as cache_dir/<session number>/<field>.npy, plus an
+    index file describing the fields and scalar attributes of each session and
+    an AreaIndex of the sessions' brain areas. Archives are unpickled one at a
+    time, so peak memory is a single archive.
+
+    Arguments:
+    data_dir -- directory containing the steinmetz_part*.npz archives
+
+    Keyword Arguments:
+    files -- archive paths to convert (defaults to all archives in data_dir)
+    cache_dir -- where to write the cache (defaults to data_dir/sessions)
+
+    Returns the cache index.
+    """
+    if type(data_dir) is str:
+        data_dir = Path(data_dir)
+    if files is None:
+        files = sorted(data_dir.glob(f"{SESSION_FILE_NAME}*.npz"))
+    if cache_dir is None:
+        cache_dir = data_dir / SESSION_CACHE_DIR
+
+    index = {
+        "version": SESSION_CACHE_VERSION,
+        "sources": _get_source_info(files),
+        "sessions": [],
+    }
+    brain_areas = {}
+    for f in files:
+        print(f"Caching {f}...")
+        sessions = np.load(f, allow_pickle=True)["dat"]
+        for session in sessions:
+            session_dir = cache_dir / f"{len(index['sessions']):02d}"
+            os.makedirs(session_dir, exist_ok=True)
+
+            fields, attrs = _split_fields(session)
+            brain_areas[len(index["sessions"])] = fields["brain_area"]
+            for key, value in fields.items():
+                np.save(session_dir / f"{key}.npy", value, allow_pickle=True)
+            # Sparse spikes converted from a previous cache are out of date
+            SparseSpikes.remove(session_dir, "spks")
+
+            index["sessions"].append(
+                {
+                    "fields": {
+                        key: {
+                            "shape": list(value.shape),
+                            "dtype": value.dtype.str,
+                            "mmap": value.dtype != object,
+                        }
+                        for key, value in fields.items()
+                    },
+                    "attrs": attrs,
+                }
+            )
+        del sessions
 
-        print(f"Downloading {file_path}...")
-        r = requests.get(url)
-        if r.status_code != requests.codes.ok:
-            raise requests.ConnectionError()
-        with open(file_path, "wb") as f:
-            f.write(r.content)
+    AreaIndex(brain_areas).save(cache_dir / AREA_INDEX_FILE)
 
+    # Written last so that an interrupted conversion is never mistaken for
+    # a complete cache
+    index_file = cache_dir / SESSION_INDEX_FILE
+    with open(f"{index_file}.tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(f"{index_file}.tmp", index_file)
 
-def load_sessions(data_dir=None, cleanup=True):
+    return index
+
+
+def load_session_index(data_dir, files=None, cache_dir=None):
+    """
+    Returns the session cache index, (re)building the cache if it is missing or
+    out of date with the archives in data_dir.
+    """
+    if type(data_dir) is str:
+        data_dir = Path(data_dir)
+    if files is None:
+        files = sorted(data_dir.glob(f"{SESSION_FILE_NAME}*.npz"))
+    if cache_dir is None:
+        cache_dir = data_dir / SESSION_CACHE_DIR
+
+    index_file = cache_dir / SESSION_INDEX_FILE
+    if index_file.exists():
+        with open(index_file, "r") as f:
+            index = json.load(f)
+        if index.get("version") == SESSION_CACHE_VERSION and index[
+            "sources"
+        ] == _get_source_info(files):
+            return index
+
+    return build_session_cache(data_dir, files=files, cache_dir=cache_dir)
+
+
+def load_sessions(data_dir=None, cleanup=True, mmap=True, max_bytes=None, sparse=False):
+    """
+    Loads the Steinmetz sessions, downloading them first if needed.
+
+    Returns a SessionCollection which loads each session's fields lazily from
+    the memory-mapped session cache. Sessions behave like the original session
+    dicts (session["spks"]), so they can be passed to get_spikes, get_selectors,
+    etc.
+
+    Keyword Arguments:
+    data_dir -- directory holding the session archives, defaults to a temporary
+        directory
+    cleanup -- remove the temporary directory once sessions are loaded
+    mmap -- memory-map session fields instead of reading them into memory
+    max_bytes -- budget for loaded session fields, least recently used sessions
+        are released when it is exceeded
+    sparse -- store spike counts as SparseSpikes, which get_spikes extracts
+        windows from without densifying the whole tensor
+    """
     tmp_dir = None
     if data_dir is None:
         tmp_dir = tempfile.TemporaryDirectory()
@@ -47,49 +314,124 @@ def load_sessions(data_dir=None, cleanup=True):
         download_sessions(data_dir)
         files = sorted(data_dir.glob(file_glob))
 
-    sessions = [None] * len(files)
-    for i, f in enumerate(files):
-        print(f"Loading {f}...")
-        sessions[i] = np.load(data_dir / f, allow_pickle=True)["dat"]
+    cache_dir = data_dir / SESSION_CACHE_DIR
+    index = load_session_index(data_dir, files=files, cache_dir=cache_dir)
 
     if tmp_dir is not None and cleanup is True:
+        # Sessions can't be lazily loaded from a cache that is about to be
+        # cleaned up
+        sessions = SessionCollection(
+            cache_dir, index, mmap_mode=None, sparse=sparse
+        ).load()
         tmp_dir.cleanup()
+        return sessions
+
+    return SessionCollection(
+        cache_dir,
+        index,
+        mmap_mode="r" if mmap else None,
+        max_bytes=max_bytes,
+        sparse=sparse,
+    )
 
-    return np.hstack(sessions)
+
+def _gather_window(all_spikes, neurons, trials, bins, out=None, chunk_size=64):
+    """
+    Gathers all_spikes[neurons, trials, bins] where bins holds the window of each
+    trial (or a single window for all trials). When out is given, neurons are
+    gathered in chunks so only a chunk-sized temporary is allocated.
+    """
+    if isinstance(all_spikes, SparseSpikes):
+        return all_spikes.window(neurons, trials, bins[:, 0], bins.shape[1], out=out)
+
+    if len(bins) == 1:
+        # A window shared by all trials is sliced, which is much faster than
+        # gathering its bins with an index array
+        neurons = neurons[:, np.newaxis]
+        bins = slice(bins[0, 0], bins[0, -1] + 1)
+    else:
+        neurons = neurons[:, np.newaxis, np.newaxis]
+        trials = trials[np.newaxis, :, np.newaxis]
+        bins = bins[np.newaxis, :, :]
+    if out is None:
+        return all_spikes[neurons, trials, bins]
+
+    for start in range(0, len(neurons), chunk_size):
+        chunk = neurons[start : start + chunk_size]
+        out[start : start + chunk_size] = all_spikes[chunk, trials, bins]
+    return out
 
 
 def get_spikes(
-    session, neurons, trials, bins, align=50, baseline_bins=None, smoothing=None
+    session,
+    neurons,
+    trials,
+    bins,
+    align=50,
+    baseline_bins=None,
+    smoothing=None,
+    smoothing_method="auto",
+    out=None,
 ):
-    all_spikes = session["spks"][neurons][:, trials]
+    """
+    Extracts a window of spike counts for the selected neurons and trials.
+
+    Only the (neuron, trial, bin) elements inside the window are gathered, in a
+    single pass over the spike tensor.
+
+    Arguments:
+    session -- session dict or Session
+    neurons -- boolean mask or indices of neurons
+    trials -- boolean mask or indices of trials
+    bins -- (start, end) of the window relative to align
+
+    Keyword Arguments:
+    align -- bin to align the window to, either a scalar or one per trial
+    baseline_bins -- (start, end) of bins to normalize firing rates by
+    smoothing -- (size, std) of the causal half-Gaussian smoothing kernel, or
+        an array of the weights of any other kernel (see
+        smoothing.exponential_kernel etc.)
+    smoothing_method -- how to convolve with the kernel, see smoothing.smooth
+    out -- array of shape (neurons, trials, bins) to write the result to, so
+        that repeated calls can reuse the same buffer
+
+    Returns an array of shape (neurons, trials, bins).
+    """
+    all_spikes = session["spks"]
+    neurons = as_indices(neurons)
+    trials = as_indices(trials)
 
     if smoothing is not None:
-        pad = smoothing[0] // 2
+        kernel = get_kernel(smoothing)
+        pad = len(kernel) // 2
         bins = np.array(bins) + [-pad, pad]
 
     bins = np.atleast_1d(align)[:, np.newaxis] + np.arange(*bins)
     bins += np.minimum(all_spikes.shape[2] - bins[:, -1] - 1, 0)[:, np.newaxis]
     bins -= np.minimum(bins[:, 0], 0)[:, np.newaxis]
-    bins = bins[np.newaxis, :, :]
 
-    spikes = np.take_along_axis(all_spikes, bins, 2)
+    # Without smoothing the window can be written straight into out
+    spikes = _gather_window(
+        all_spikes, neurons, trials, bins, out=out if smoothing is None else None
+    )
 
     if baseline_bins is not None:
         start, end = baseline_bins
-        baseline = all_spikes[:, :, start:end]
+        baseline = _gather_window(
+            all_spikes, neurons, trials, np.arange(start, end)[np.newaxis, :]
+        )
         baseline = baseline.mean(axis=2, keepdims=True)
-        spikes = (spikes - baseline) / (baseline + 0.5)
+        if spikes is not out:
+            spikes = spikes.astype(np.float64)
+        spikes -= baseline
+        spikes /= baseline + 0.5
 
     if smoothing is not None:
-        size, std = smoothing
-        half_gaussian = signal.gaussian(size, std)
-        half_gaussian[size // 2 + 1 :] = 0
-        spikes = signal.convolve(
-            spikes,
-            half_gaussian[np.newaxis, np.newaxis, :],
-            mode="valid",
-            method="direct",
-        )
+        spikes = smooth(spikes, kernel, method=smoothing_method, out=out)
+
+    if out is not None and spikes is not out:
+        out[...] = spikes
+        return out
 
     return spikes
 
@@ -100,24 +442,20 @@ def reshape_by_bins(spikes):
     )
 
 
+def load_decoder_results(data_dir):
+    """Returns every decoder result as a {session: {area: results}} dict"""
+    return open_results(data_dir).to_dict()
+
+
 def save_decoder_results(
-    data_dir, session_number, trials_selector, area, decisions, decoder,
+    data_dir, session_number, trials_selector, area, decisions, decoder, threshold=None
 ):
-    results = {}
-    results_file = data_dir / "decoder_results.pickle"
-    if results_file.exists():
-        with open(results_file, "rb") as f:
-            results = pickle.load(f)
-
-    if session_number not in results:
-        results[session_number] = {}
-
-    results[session_number][area] = {
-        "trial_numbers": np.where(trials_selector)[0],
-        "decision_times": decisions[:, 1] * 10,
-        "decisions": decisions[:, 0],
-        "decoder": decoder,
-    }
-
-    with open(results_file, "wb") as f:
-        pickle.dump(results, f)
+    open_results(data_dir).put(
+        session_number,
+        area,
+        trial_numbers=np.where(trials_selector)[0],
+        decision_times=decisions[:, 1] * 10,
+        decisions=decisions[:, 0],
+        decoder=decoder,
+        threshold=threshold,
+    )
@@ -1,34 +1,212 @@
 import numpy as np
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from sklearn.model_selection import StratifiedKFold
 from sklearn.metrics import confusion_matrix
 from .data import get_spikes, reshape_by_bins
-from .plotting import plot_confusion
 
 
-def cross_validate(clf, X, y):
+def _map_shared(fn, clf, X, arg_tuples, n_jobs=1, backend="thread"):
+    """
+    Calls fn(clf, X, *args) for each args in arg_tuples, returning the results
+    in order.
+
+    Arguments:
+    fn -- function to call, given X either as an array or as the path of a .npy
+        file to memory-map
+    clf -- classifier passed to every call
+    X -- array shared by every call
+    arg_tuples -- remaining arguments of each call
+
+    Keyword Arguments:
+    n_jobs -- number of calls to run in parallel
+    backend -- "thread" or "process". Process workers share X through a
+        memory-mapped temporary file rather than a pickled copy.
+    """
+    if n_jobs == 1:
+        return [fn(clf, X, *args) for args in arg_tuples]
+    if backend == "thread":
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            return list(executor.map(lambda args: fn(clf, X, *args), arg_tuples))
+    if backend == "process":
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            X_file = os.path.join(tmp_dir, "X.npy")
+            np.save(X_file, X)
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                return list(
+                    executor.map(
+                        fn, *zip(*[(clf, X_file, *args) for args in arg_tuples])
+                    )
+                )
+    raise ValueError(f"Unknown backend {backend}")
+
+
+def _fit_fold(clf, X, y, train_index, val_index, num_bins):
+    if isinstance(X, str):
+        # Process workers memory-map the spikes instead of receiving a copy
+        X = np.load(X, mmap_mode="r")
+
+    train_rows = (train_index[:, np.newaxis] * num_bins + np.arange(num_bins)).ravel()
+    val_rows = (val_index[:, np.newaxis] * num_bins + np.arange(num_bins)).ravel()
+
+    split_clf = type(clf)(**clf.get_params())
+    split_clf.fit(X[train_rows], np.repeat(y[train_index], num_bins))
+    split_pred = split_clf.predict(X[val_rows])
+    return (
+        val_rows,
+        split_pred,
+        np.mean(split_pred == np.repeat(y[val_index], num_bins)),
+    )
+
+
+def cross_validate(clf, X, y, n_jobs=1, backend="thread"):
+    """
+    Stratified 5-fold cross-validation of clf, treating every bin of a trial as
+    a sample with the trial's label.
+
+    Arguments:
+    clf -- classifier, a fresh copy is fit on each fold
+    X -- spikes of shape (neurons, trials, bins)
+    y -- label of each trial
+
+    Keyword Arguments:
+    n_jobs -- number of folds to fit in parallel
+    backend -- "thread" or "process". Process workers share X through a
+        memory-mapped temporary file rather than a pickled copy.
+
+    Returns the prediction for every trial and bin, and the score of each fold.
+    """
     trials = np.arange(X.shape[1])
     num_bins = X.shape[2]
+    X = reshape_by_bins(X)
 
     skf = StratifiedKFold(n_splits=5)
+    splits = list(skf.split(trials, y))
+    fit_args = [(y, train, val, num_bins) for train, val in splits]
+    results = _map_shared(_fit_fold, clf, X, fit_args, n_jobs, backend)
+
+    # Results come back in fold order regardless of which worker finished first
     y_pred = np.zeros((len(y) * num_bins))
     scores = []
-    for train_index, val_index in skf.split(trials, y):
-        X_train = reshape_by_bins(X[:, train_index, -num_bins:])
-        X_val = reshape_by_bins(X[:, val_index, -num_bins:])
-        y_train = np.repeat(y[train_index], num_bins)
-        y_val = np.repeat(y[val_index], num_bins)
-
-        split_clf = type(clf)(**clf.get_params())
-        split_clf.fit(X_train, y_train)
-        split_pred = split_clf.predict(X_val)
-        scores.append(np.mean(split_pred == y_val))
-        y_pred[
-            (val_index[:, np.newaxis] * num_bins + np.arange(num_bins)).flatten()
-        ] = split_pred
+    for val_rows, split_pred, score in results:
+        y_pred[val_rows] = split_pred
+        scores.append(score)
 
     return y_pred, scores
 
 
+def _fit_windows(clf, X, y, train_index, val_index, windows, warm_start):
+    if isinstance(X, str):
+        X = np.load(X, mmap_mode="r")
+
+    num_neurons = X.shape[2]
+    split_clf = type(clf)(**clf.get_params())
+    if warm_start:
+        split_clf.set_params(warm_start=True)
+
+    correct = np.empty((len(windows), len(val_index)))
+    for i, (start, end) in enumerate(windows):
+        if not warm_start:
+            split_clf = type(clf)(**clf.get_params())
+        num_bins = end - start
+        split_clf.fit(
+            X[train_index, start:end].reshape(-1, num_neurons),
+            np.repeat(y[train_index], num_bins),
+        )
+        split_pred = split_clf.predict(X[val_index, start:end].reshape(-1, num_neurons))
+        correct[i] = np.mean(
+            split_pred.reshape(len(val_index), num_bins) == y[val_index, np.newaxis],
+            axis=1,
+        )
+    return correct
+
+
+def cross_validate_windows(
+    clf,
+    X,
+    y,
+    window=10,
+    step=None,
+    warm_start=False,
+    ci=0.95,
+    num_bootstrap=1000,
+    random_state=None,
+    n_jobs=1,
+    backend="thread",
+):
+    """
+    Time-resolved version of cross_validate, which fits and scores a separate
+    classifier on each window of bins. Every window uses the same stratified
+    5-fold splits of the trials as cross_validate, and the spikes are only
+    reshaped once for all of them.
+
+    Arguments:
+    clf -- classifier, a fresh copy is fit on each fold and window
+    X -- spikes of shape (neurons, trials, bins)
+    y -- label of each trial
+
+    Keyword Arguments:
+    window -- number of bins per window, the bins of a window are pooled as in
+        cross_validate
+    step -- bins between the starts of consecutive windows, defaults to window
+    warm_start -- start each window's fit from the previous window's
+        coefficients, for classifiers with a warm_start parameter such as
+        LogisticRegression
+    ci -- width of the bootstrap confidence interval of the accuracy
+    num_bootstrap -- number of bootstrap resamples of the trials
+    random_state -- seed of the bootstrap
+    n_jobs -- number of workers. Each fold's windows are split into n_jobs
+        consecutive blocks that are fit in parallel (with warm_start, the first
+        window of each block starts from scratch).
+    backend -- "thread" or "process", see cross_validate
+
+    Returns a dict of
+    bins -- first bin of each window
+    accuracy -- cross-validated accuracy of each window
+    ci -- lower and upper confidence bound of each window's accuracy
+    scores -- score of each fold in each window
+    """
+    num_trials, num_bins = X.shape[1:]
+    step = window if step is None else step
+    starts = np.arange(0, num_bins - window + 1, step)
+    windows = np.column_stack([starts, starts + window])
+    blocks = [block for block in np.array_split(windows, n_jobs) if len(block)]
+    X = np.ascontiguousarray(X.transpose((1, 2, 0)))
+
+    skf = StratifiedKFold(n_splits=5)
+    splits = list(skf.split(np.arange(num_trials), y))
+    fit_args = [
+        (y, train, val, block, warm_start) for train, val in splits for block in blocks
+    ]
+    results = _map_shared(_fit_windows, clf, X, fit_args, n_jobs, backend)
+
+    # Fraction of each trial's bins predicted correctly, by window
+    correct = np.empty((len(windows), num_trials))
+    scores = np.empty((len(windows), len(splits)))
+    results = iter(results)
+    for fold, (_, val) in enumerate(splits):
+        fold_correct = np.concatenate([next(results) for _ in blocks])
+        correct[:, val] = fold_correct
+        scores[:, fold] = fold_correct.mean(axis=1)
+
+    # Resampling trials with replacement is the same as weighting them by
+    # multinomial counts, which avoids indexing correct once per resample
+    rng = np.random.default_rng(random_state)
+    counts = rng.multinomial(
+        num_trials, np.full(num_trials, 1 / num_trials), size=num_bootstrap
+    )
+    bootstrap = correct @ counts.T / num_trials
+    alpha = (1 - ci) / 2
+
+    return {
+        "bins": starts,
+        "accuracy": correct.mean(axis=1),
+        "ci": np.quantile(bootstrap, [alpha, 1 - alpha], axis=1).T,
+        "scores": scores,
+    }
+
+
 def cv_and_fit(
     clf,
     session,
@@ -41,12 +219,28 @@ def cv_and_fit(
     align=50,
     baseline_bins=None,
     smoothing=(17, 2.5),
+    smoothing_method="auto",
     cv=True,
     fit=True,
+    cache=None,
+    n_jobs=1,
+    backend="thread",
+    plot=False,
+    verbose=True,
 ):
+    """
+    Cross-validates the classifier on the spikes of the selected neurons and
+    trials, then fits it on all of them.
+
+    Returns the confidence threshold of each class but the first, from the
+    cross-validated confusion matrix, and the confusion matrix itself (both
+    None if cv is False). With plot=True the confusion matrix is also plotted,
+    which imports matplotlib.
+    """
     num_classes = len(class_names)
 
-    spikes = get_spikes(
+    # A SpikeCache skips extraction entirely when only the classifier changes
+    spikes = (get_spikes if cache is None else cache.get_spikes)(
         session,
         neurons,
         trials,
@@ -54,16 +248,24 @@ def cv_and_fit(
         align=align,
         baseline_bins=baseline_bins,
         smoothing=smoothing,
+        smoothing_method=smoothing_method,
     )
     labels = labels[trials]
 
     confidence_threshold = None
+    confusion = None
     if cv:
-        y_pred, scores = cross_validate(clf, spikes, labels)
-        print(scores)
-        print(np.mean(scores))
+        y_pred, scores = cross_validate(
+            clf, spikes, labels, n_jobs=n_jobs, backend=backend
+        )
+        if verbose:
+            print(scores)
+            print(np.mean(scores))
         confusion = confusion_matrix(np.repeat(labels, spikes.shape[2]), y_pred)
-        plot_confusion(confusion, class_names, title="Cross-val perf by bin")
+        if plot:
+            from .plotting import plot_confusion
+
+            plot_confusion(confusion, class_names, title="Cross-val perf by bin")
         confidence_threshold = (
             np.diag(confusion).astype(np.float) / confusion.sum(axis=0)
         )[1:]
@@ -71,34 +273,88 @@ def cv_and_fit(
     if fit:
         clf.fit(reshape_by_bins(spikes), np.repeat(labels, spikes.shape[2]))
 
-    return confidence_threshold
+    return confidence_threshold, confusion
+
+
+def cv_over_time(
+    clf,
+    session,
+    neurons,
+    trials,
+    bins,
+    labels,
+    align=50,
+    baseline_bins=None,
+    smoothing=(17, 2.5),
+    smoothing_method="auto",
+    cache=None,
+    **kwargs,
+):
+    """
+    Cross-validated decoding accuracy over time. The spikes of the selected
+    neurons and trials are extracted once for the whole of bins, then
+    cross_validate_windows fits a classifier on each window of them.
+
+    Keyword arguments not listed here (window, step, warm_start, ci, n_jobs
+    etc.) are passed to cross_validate_windows.
+
+    Returns the result of cross_validate_windows, with bins relative to align.
+    """
+    spikes = (get_spikes if cache is None else cache.get_spikes)(
+        session,
+        neurons,
+        trials,
+        bins,
+        align=align,
+        baseline_bins=baseline_bins,
+        smoothing=smoothing,
+        smoothing_method=smoothing_method,
+    )
+    result = cross_validate_windows(clf, spikes, labels[trials], **kwargs)
+    result["bins"] = result["bins"] + bins[0]
+    return result
 
 
 def decode(clf, spikes, threshold):
+    """
+    Accumulates the classifier's per-bin log probabilities into posteriors over
+    time for each trial, and finds the class and bin at which each trial's
+    posterior first crosses its threshold.
+
+    All trials are decoded together: the classifier is evaluated once on every
+    trial and bin, and the posterior update is vectorized over trials.
+
+    Arguments:
+    clf -- fitted classifier with predict_log_proba
+    spikes -- array of shape (neurons, trials, bins)
+    threshold -- posterior threshold of each class but the first
+
+    Returns decisions, an array of (class, bin) per trial where class 0 means
+    no decision, and posteriors of shape (trials, bins, classes).
+    """
     _, num_trials, num_bins = spikes.shape
     num_classes = len(np.atleast_1d(threshold)) + 1
+    eps = np.finfo(np.float64).eps
+
+    likelihoods = clf.predict_log_proba(reshape_by_bins(spikes))
+    likelihoods = likelihoods.reshape(num_trials, num_bins, num_classes)
+
+    posteriors = np.empty((num_trials, num_bins, num_classes))
+    posteriors[:, 0] = likelihoods[:, 0]
+    for i in range(1, num_bins):
+        prob = np.exp(posteriors[:, i - 1] + likelihoods[:, i]) + eps
+        posteriors[:, i] = np.log(prob / prob.sum(axis=1, keepdims=True))
+    posteriors = np.exp(posteriors)
+
+    # First bin at which each class crosses its threshold (0 if it never does)
+    decided = np.argmax(posteriors[:, :, 1:] > threshold, axis=1)
+    has_decided = decided > 0
+    # The highest class that crossed its threshold
+    decision = num_classes - np.argmax(has_decided[:, ::-1], axis=1) - 1
 
-    X = reshape_by_bins(spikes)
-    decisions = np.zeros((num_trials, 2), np.int)
-    posteriors = np.zeros((num_trials, num_bins, num_classes), np.float)
-    eps = np.finfo(np.float).eps
-
-    for trial_num in range(num_trials):
-        population_activity = X[
-            (trial_num * num_bins) : ((trial_num + 1) * num_bins), :
-        ]
-        likelihoods = clf.predict_log_proba(population_activity)
-
-        posteriors[trial_num, 0] = likelihoods[0]
-        for i in range(1, num_bins):
-            prob = np.exp(posteriors[trial_num, i - 1] + likelihoods[i]) + eps
-            posteriors[trial_num, i] = np.log(prob / prob.sum())
-        posteriors[trial_num] = np.exp(posteriors[trial_num])
-
-        decision = 0
-        decided = np.argmax(posteriors[trial_num, :, 1:] > threshold, axis=0)
-        if np.any(decided):
-            decision = num_classes - np.argmax(decided[::-1] > 0) - 1
-            decisions[trial_num] = [decision, decided[decision - 1]]
+    decisions = np.zeros((num_trials, 2), int)
+    is_decided = has_decided.any(axis=1)
+    decisions[is_decided, 0] = decision[is_decided]
+    decisions[is_decided, 1] = decided[is_decided, decision[is_decided] - 1]
 
     return decisions, posteriors
@@ -0,0 +1,104 @@
+import numpy as np
+
+
+def _log_sigmoid(x):
+    return -np.logaddexp(0, -x)
+
+
+def _log_normalize(x):
+    x_max = x.max(axis=1, keepdims=True)
+    return x - (x_max + np.log(np.exp(x - x_max).sum(axis=1, keepdims=True)))
+
+
+class LinearDecoder:
+    """
+    NumPy-only version of a fitted logistic regression decoder, which can be
+    stored as a few small arrays instead of a pickled sklearn object.
+
+    Arguments:
+    coef -- coefficients, of shape (1, neurons) for two classes or
+        (classes, neurons) otherwise
+    intercept -- intercept of each row of coef
+    classes -- class labels
+
+    Keyword Arguments:
+    multi_class -- "ovr" or "multinomial", how probabilities of more than two
+        classes are computed
+    threshold -- decoder confidence threshold of each class but the first
+    """
+
+    def __init__(self, coef, intercept, classes, multi_class="ovr", threshold=None):
+        self.coef_ = np.asarray(coef)
+        self.intercept_ = np.asarray(intercept)
+        self.classes_ = np.asarray(classes)
+        self.multi_class = str(multi_class)
+        self.threshold = None if threshold is None else np.asarray(threshold)
+
+    def __repr__(self):
+        return (
+            f"LinearDecoder(classes={list(self.classes_)}, "
+            f"neurons={self.coef_.shape[1]}, multi_class={self.multi_class})"
+        )
+
+    @classmethod
+    def from_sklearn(cls, clf, threshold=None):
+        """Exports a fitted sklearn LogisticRegression"""
+        from sklearn.linear_model import LogisticRegression
+
+        if not isinstance(clf, LogisticRegression):
+            raise ValueError(f"Can't export {type(clf).__name__} as a LinearDecoder")
+
+        params = clf.get_params()
+        multi_class = params["multi_class"]
+        if multi_class == "auto":
+            # As in sklearn, which fits these solvers one-vs-rest
+            ovr_solvers = ("liblinear", "newton-cholesky")
+            is_ovr = len(clf.classes_) <= 2 or params["solver"] in ovr_solvers
+            multi_class = "ovr" if is_ovr else "multinomial"
+        return cls(clf.coef_, clf.intercept_, clf.classes_, multi_class, threshold)
+
+    def to_arrays(self, prefix=""):
+        arrays = {
+            f"{prefix}coef": self.coef_,
+            f"{prefix}intercept": self.intercept_,
+            f"{prefix}classes": self.classes_,
+            f"{prefix}multi_class": np.array(self.multi_class),
+        }
+        if self.threshold is not None:
+            arrays[f"{prefix}threshold"] = self.threshold
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix=""):
+        threshold = f"{prefix}threshold"
+        return cls(
+            arrays[f"{prefix}coef"],
+            arrays[f"{prefix}intercept"],
+            arrays[f"{prefix}classes"],
+            multi_class=arrays[f"{prefix}multi_class"].item(),
+            threshold=arrays[threshold] if threshold in arrays else None,
+        )
+
+    def decision_function(self, X):
+        scores = X @ self.coef_.T + self.intercept_
+        return scores.ravel() if scores.shape[1] == 1 else scores
+
+    def predict_log_proba(self, X):
+        scores = self.decision_function(X)
+        if scores.ndim == 1:
+            if self.multi_class == "multinomial":
+                # sklearn takes the softmax of [-scores, scores] for two classes
+                scores = 2 * scores
+            return np.column_stack([_log_sigmoid(-scores), _log_sigmoid(scores)])
+        if self.multi_class == "multinomial":
+            return _log_normalize(scores)
+        return _log_normalize(_log_sigmoid(scores))
+
+    def predict_proba(self, X):
+        return np.exp(self.predict_log_proba(X))
+
+    def predict(self, X):
+        scores = self.decision_function(X)
+        if scores.ndim == 1:
+            return self.classes_[(scores > 0).astype(int)]
+        return self.classes_[scores.argmax(axis=1)]
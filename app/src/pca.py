@@ -1,37 +1,115 @@
 import numpy as np
-from sklearn.decomposition import PCA
+from sklearn.decomposition import PCA, IncrementalPCA
 from scipy.interpolate import interp1d
 
 
-def run_pca(dat):
+def _flip_signs(W):
+    # Same convention as IncrementalPCA: largest loading of each PC is positive
+    signs = np.sign(W[np.arange(len(W)), np.argmax(np.abs(W), axis=1)])
+    signs[signs == 0] = 1
+    return W * signs[:, np.newaxis]
+
+
+def _trial_batches(dat, batch_size, min_samples=0):
+    # Samples (trials * bins) x neurons, a batch of trials at a time, so that
+    # memory-mapped spikes (e.g. from the spike cache) are read one batch at a time.
+    # Batches have at least min_samples samples, a short last batch is merged
+    # into the one before it.
+    NN, num_trials = dat.shape[:2]
+    bins_per_trial = int(np.prod(dat.shape[2:]))
+    batch_size = max(batch_size or num_trials, -(-min_samples // bins_per_trial))
+    starts = list(range(0, num_trials, batch_size))
+    if len(starts) > 1 and (num_trials - starts[-1]) * bins_per_trial < min_samples:
+        starts.pop()
+    for start, end in zip(starts, starts[1:] + [num_trials]):
+        batch = np.asarray(dat[:, start:end], dtype=np.float64)
+        yield np.reshape(batch, (NN, -1)).T
+
+
+def _covariance_pca(dat, n_components, batch_size):
+    NN = len(dat)
+    num_samples = 0
+    sums = np.zeros(NN)
+    gram = np.zeros((NN, NN))
+    for X in _trial_batches(dat, batch_size):
+        num_samples += len(X)
+        sums += X.sum(axis=0)
+        gram += X.T @ X
+    mean = sums / num_samples
+    cov = (gram - num_samples * np.outer(mean, mean)) / (num_samples - 1)
+
+    eigenvalues, eigenvectors = np.linalg.eigh(cov)
+    order = np.argsort(eigenvalues)[::-1][:n_components]
+    W = _flip_signs(eigenvectors[:, order].T)
+    V = np.maximum(eigenvalues[order], 0)
+    return W, V, np.trace(cov)
+
+
+def run_pca(dat, method="full", n_components=None, batch_size=None, random_state=None):
     """
     run pca on each brain area
 
     Args:
     X (numpy array of floats): Data matrix each column corresponds to a
                                different random variable
+    method (str): "full" for an exact full SVD, "randomized" for a randomized
+                  SVD of the leading n_components, "incremental" for
+                  IncrementalPCA over batches of trials, or "covariance" for an
+                  eigendecomposition of the neuron covariance matrix, built
+                  batch by batch (fastest when neurons << trials * bins)
+    n_components (int): number of pcs, defaults to all of them
+    batch_size (int): number of trials per batch for "incremental" and
+                      "covariance". Incremental batches are enlarged to
+                      at least n_components samples if needed.
+    random_state (int): seed of the randomized SVD
 
     Returns:
     variance_explained (numpy array of floats)  : percentage of variances explained by pcs
     V (numpy array of floats)  : Vector of eigenvalues
     W (numpy array of floats)  : Corresponding matrix of eigenvectors
 
+    variance_explained is relative to the total variance, so it is the same for
+    the leading pcs whichever method and n_components are used.
     """
     dt = 10  # binning at 10 ms
-    NT = dat.shape[-1]
 
     NN = len(dat)
+    max_components = min(NN, int(np.prod(dat.shape[1:])))
+    if n_components is None:
+        n_components = max_components
+
+    if method == "covariance":
+        W, V, total_variance = _covariance_pca(dat, n_components, batch_size)
+    elif method == "incremental":
+        model = IncrementalPCA(n_components=n_components)
+        for X in _trial_batches(dat, batch_size, min_samples=n_components):
+            model.partial_fit(X)
+        W = model.components_
+        V = model.explained_variance_
+        num_samples = model.n_samples_seen_
+        total_variance = np.sum(model.var_) * num_samples / (num_samples - 1)
+    elif method in ("full", "randomized"):
+        # top PC directions from stimulus + response period
+
+        droll = np.reshape(dat, (NN, -1))  # first 80 bins = 1.6 sec
+        droll = droll - np.mean(droll, axis=1)[:, np.newaxis]
+        model = PCA(
+            n_components=n_components,
+            svd_solver="full" if method == "full" else "randomized",
+            random_state=random_state,
+        ).fit(droll.T)
+
+        W = model.components_  # eigenvectors
+        V = model.explained_variance_  # eigenvalues
+        if n_components == max_components:
+            total_variance = np.sum(V)
+        else:
+            total_variance = np.sum(np.var(droll, axis=1, ddof=1))
+    else:
+        raise ValueError(f"Unknown PCA method {method}")
 
-    # top PC directions from stimulus + response period
-
-    droll = np.reshape(dat, (NN, -1))  # first 80 bins = 1.6 sec
-    droll = droll - np.mean(droll, axis=1)[:, np.newaxis]
-    model = PCA(n_components=min(droll.shape[0], droll.shape[1])).fit(droll.T)
-
-    W = model.components_  # eigenvectors
-    V = model.explained_variance_  # eigenvalues
     csum = np.cumsum(V)
-    variance_explained = csum / np.sum(V)
+    variance_explained = csum / total_variance
 
     return W, V, variance_explained
 
@@ -47,9 +125,11 @@ def smt_pca(dat, n):
 
     # smoothing mean trajectory
 
-    x = np.linspace(0, len(dat) - 1, num=len(dat))
+    # one cubic fit along the last axis smooths every row of dat at once
+    num_bins = dat.shape[-1]
+    x = np.linspace(0, num_bins - 1, num=num_bins)
     xnew = np.linspace(0, np.max(x), num=n, endpoint=True)
-    f = interp1d(x, dat, kind="cubic")
+    f = interp1d(x, dat, kind="cubic", axis=-1)
     pc_smt = f(xnew)
 
     return pc_smt
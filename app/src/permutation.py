@@ -0,0 +1,155 @@
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+from sklearn.linear_model import RidgeClassifier
+from sklearn.model_selection import StratifiedKFold
+from .decoding import _fit_fold, _map_shared
+
+
+def _is_batchable(clf):
+    # RidgeClassifier fits with a closed-form solve whose Gram matrix only
+    # depends on the spikes, so every permutation of a fold can share it
+    if type(clf) is not RidgeClassifier:
+        return False
+    params = clf.get_params()
+    return (
+        np.isscalar(params["alpha"])
+        and params["class_weight"] is None
+        and not params.get("positive", False)
+    )
+
+
+def _ridge_scores(clf, X, labels, splits, num_classes):
+    """
+    Cross-validated scores of a RidgeClassifier for each row of labels, solving
+    for all of them at once in every fold.
+
+    Arguments:
+    clf -- RidgeClassifier
+    X -- spikes of shape (trials, bins, neurons)
+    labels -- array of shape (permutations, trials)
+    splits -- (train, val) trial indices of each fold
+    num_classes -- number of classes, labels run from 0 to num_classes - 1
+    """
+    alpha = clf.get_params()["alpha"]
+    fit_intercept = clf.get_params()["fit_intercept"]
+    num_permutations = len(labels)
+    num_neurons = X.shape[2]
+
+    scores = np.empty((num_permutations, len(splits)))
+    for fold, (train, val) in enumerate(splits):
+        X_train = X[train].reshape(-1, num_neurons).astype(np.float64)
+        x_mean = X_train.mean(axis=0) if fit_intercept else np.zeros(num_neurons)
+        X_train -= x_mean
+        gram = X_train.T @ X_train
+        gram[np.diag_indices_from(gram)] += alpha
+
+        # Targets are +1 for the trial's class and -1 otherwise, as in
+        # RidgeClassifier. Every bin of a trial has the same target, so X'Y only
+        # needs the sum of each trial's bins.
+        Y = np.where(labels[:, train, np.newaxis] == np.arange(num_classes), 1.0, -1.0)
+        Y = Y.transpose((1, 0, 2)).reshape(len(train), -1)
+        y_mean = Y.mean(axis=0) if fit_intercept else 0
+        trial_sums = X_train.reshape(len(train), -1, num_neurons).sum(axis=1)
+        coef = cho_solve(cho_factor(gram), trial_sums.T @ (Y - y_mean))
+
+        X_val = X[val].reshape(-1, num_neurons) - x_mean
+        y_pred = (X_val @ coef + y_mean).reshape(
+            len(val), -1, num_permutations, num_classes
+        )
+        is_correct = y_pred.argmax(axis=3) == labels[:, val].T[:, np.newaxis]
+        scores[:, fold] = is_correct.mean(axis=(0, 1))
+
+    return scores
+
+
+def _permutation_scores(clf, X, y, splits, seeds):
+    if isinstance(X, str):
+        # Process workers memory-map the spikes instead of receiving a copy
+        X = np.load(X, mmap_mode="r")
+
+    # A seed of None keeps the labels in order, for the unshuffled score
+    labels = np.array(
+        [
+            y if seed is None else np.random.default_rng(seed).permutation(y)
+            for seed in seeds
+        ]
+    )
+
+    if _is_batchable(clf):
+        num_classes = y.max() + 1
+        return _ridge_scores(clf, X, labels, splits, num_classes).mean(axis=1)
+
+    num_bins = X.shape[1]
+    X = X.reshape(-1, X.shape[2])
+    return np.array(
+        [
+            np.mean(
+                [
+                    _fit_fold(clf, X, shuffled, train, val, num_bins)[2]
+                    for train, val in splits
+                ]
+            )
+            for shuffled in labels
+        ]
+    )
+
+
+def permutation_test(
+    clf, X, y, num_permutations=1000, seed=None, batch_size=100, n_jobs=1
+):
+    """
+    Tests whether the cross-validated score of clf is above chance, by comparing
+    it to the scores of the same classifier on shuffled labels.
+
+    Every permutation shuffles the trial labels and is scored with the same
+    stratified 5-fold splits as the unshuffled labels in cross_validate. Each
+    permutation draws its shuffle from its own child of np.random.SeedSequence
+    (seed), so the null distribution only depends on seed, not on batch_size or
+    n_jobs.
+
+    A RidgeClassifier (with a scalar alpha, no class weights and no positivity
+    constraint) fits every permutation of a batch with one shared solve per fold,
+    which is much faster than refitting. Any other classifier is refit for every
+    permutation and fold.
+
+    Arguments:
+    clf -- classifier, a fresh copy is fit on each permutation and fold
+    X -- spikes of shape (neurons, trials, bins)
+    y -- label of each trial
+
+    Keyword Arguments:
+    num_permutations -- number of label shuffles
+    seed -- seed of the shuffles
+    batch_size -- number of permutations fit together by a worker
+    n_jobs -- number of worker processes. Workers share X through a
+        memory-mapped temporary file rather than a pickled copy.
+
+    Returns a dict of
+    score -- cross-validated score with the real labels, the mean of the fold
+        scores
+    null -- score of each permutation
+    p_value -- fraction of permutations scoring at least as well as the real
+        labels, counting the real labels as one of them
+    """
+    y = np.unique(y, return_inverse=True)[1]
+    num_trials = X.shape[1]
+    X = np.ascontiguousarray(X.transpose((1, 2, 0)))
+
+    skf = StratifiedKFold(n_splits=5)
+    splits = list(skf.split(np.arange(num_trials), y))
+
+    seeds = np.random.SeedSequence(seed).spawn(num_permutations)
+    batches = [seeds[i : i + batch_size] for i in range(0, len(seeds), batch_size)]
+
+    score = _permutation_scores(clf, X, y, splits, [None])[0]
+    batch_args = [(y, splits, batch) for batch in batches]
+    null = _map_shared(
+        _permutation_scores, clf, X, batch_args, n_jobs, backend="process"
+    )
+    null = np.concatenate(null)
+
+    return {
+        "score": score,
+        "null": null,
+        "p_value": (1 + np.sum(null >= score)) / (1 + num_permutations),
+    }
@@ -0,0 +1,166 @@
+import fcntl
+import numpy as np
+import os
+import pickle
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+from .linear import LinearDecoder
+
+
+RESULTS_DIR = "decoder_results"
+RESULTS_PICKLE = "decoder_results.pickle"
+
+
+class ResultsStore:
+    """
+    Decoder results stored as one .npz file per session and area, under
+    root/<session>/<area>.npz.
+
+    Entries are written to a temporary file and renamed into place, so readers
+    never see a partial entry, and writers hold an exclusive lock on the store
+    while doing so. Reading an entry only loads that entry's file.
+
+    Logistic regression decoders are stored as LinearDecoder arrays, so reading
+    them back doesn't need sklearn or unpickling. Any other decoder is pickled.
+
+    Arguments:
+    root -- directory of the store
+    """
+
+    def __init__(self, root):
+        if type(root) is str:
+            root = Path(root)
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+
+    def _path(self, session, area):
+        if "/" in str(area) or str(area).startswith("."):
+            raise ValueError(f"Invalid area name {area}")
+        return self.root / str(session) / f"{area}.npz"
+
+    @contextmanager
+    def lock(self):
+        with open(self.root / ".lock", "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def put(
+        self,
+        session,
+        area,
+        trial_numbers,
+        decision_times,
+        decisions,
+        decoder,
+        threshold=None,
+    ):
+        path = self._path(session, area)
+        os.makedirs(path.parent, exist_ok=True)
+        tmp_path = path.with_name(f".{area}.{os.getpid()}.tmp.npz")
+
+        arrays = {
+            "trial_numbers": trial_numbers,
+            "decision_times": decision_times,
+            "decisions": decisions,
+        }
+        if isinstance(decoder, LinearDecoder):
+            if threshold is not None:
+                decoder.threshold = np.asarray(threshold)
+            arrays.update(decoder.to_arrays(prefix="decoder_"))
+        else:
+            try:
+                decoder = LinearDecoder.from_sklearn(decoder, threshold=threshold)
+                arrays.update(decoder.to_arrays(prefix="decoder_"))
+            except (ImportError, ValueError):
+                arrays["decoder"] = np.frombuffer(pickle.dumps(decoder), np.uint8)
+                if threshold is not None:
+                    arrays["threshold"] = threshold
+
+        with self.lock():
+            np.savez(tmp_path, **arrays)
+            os.replace(tmp_path, path)
+
+    def get(self, session, area, load_decoder=True):
+        """
+        Returns the results of a session and area as a dict of trial_numbers,
+        decision_times, decisions, decoder and threshold (None if not saved).
+        """
+        path = self._path(session, area)
+        if not path.exists():
+            raise KeyError((session, area))
+
+        with np.load(path) as entry:
+            result = {
+                "trial_numbers": entry["trial_numbers"],
+                "decision_times": entry["decision_times"],
+                "decisions": entry["decisions"],
+                "threshold": entry["threshold"] if "threshold" in entry else None,
+            }
+            if "decoder_coef" in entry:
+                result["decoder"] = LinearDecoder.from_arrays(entry, prefix="decoder_")
+                result["threshold"] = result["decoder"].threshold
+            elif load_decoder:
+                result["decoder"] = pickle.loads(entry["decoder"].tobytes())
+        return result
+
+    def __contains__(self, key):
+        return self._path(*key).exists()
+
+    def keys(self):
+        """Returns (session, area) pairs with results"""
+        keys = []
+        for session_dir in self.root.iterdir():
+            if not session_dir.is_dir():
+                continue
+            session = int(session_dir.name)
+            keys.extend(
+                (session, path.stem)
+                for path in session_dir.glob("*.npz")
+                if not path.name.startswith(".")
+            )
+        return sorted(keys)
+
+    def to_dict(self, load_decoder=True):
+        """All results as the nested {session: {area: results}} dict"""
+        results = {}
+        for session, area in self.keys():
+            results.setdefault(session, {})[area] = self.get(
+                session, area, load_decoder=load_decoder
+            )
+        return results
+
+    def migrate_pickle(self, pickle_file):
+        """Copies every entry of a decoder_results.pickle file into the store"""
+        with open(pickle_file, "rb") as f:
+            results = pickle.load(f)
+        for session, areas in results.items():
+            for area, result in areas.items():
+                self.put(session, area, **result)
+
+
+def open_results(data_dir):
+    """
+    Opens the results store in data_dir, migrating decoder_results.pickle into
+    it if the store doesn't exist yet.
+    """
+    if type(data_dir) is str:
+        data_dir = Path(data_dir)
+
+    root = data_dir / RESULTS_DIR
+    pickle_file = data_dir / RESULTS_PICKLE
+    if root.exists() or not pickle_file.exists():
+        return ResultsStore(root)
+
+    # Migrate into a temporary store so an interrupted migration is retried
+    tmp_root = data_dir / f".{RESULTS_DIR}.{os.getpid()}.tmp"
+    ResultsStore(tmp_root).migrate_pickle(pickle_file)
+    try:
+        os.rename(tmp_root, root)
+    except OSError:
+        # Another process finished migrating first
+        shutil.rmtree(tmp_root)
+    return ResultsStore(root)
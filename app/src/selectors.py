@@ -1,7 +1,64 @@
+import ast
 import numpy as np
+import weakref
+from collections.abc import MutableMapping
 from .brain_areas import AREAS_ACTION, AREAS_MOTOR, AREAS_VISUAL
 
 
+def _running(x, size, op):
+    # op (np.maximum or np.minimum) over each window of size bins along the last
+    # axis, by doubling the window width, in log2(size) vectorized passes
+    width = 1
+    while 2 * width <= size:
+        x = op(x[..., :-width], x[..., width:])
+        width *= 2
+    if width < size:
+        x = op(x[..., : x.shape[-1] - (size - width)], x[..., size - width :])
+    return x
+
+
+def get_movement_onsets(wheel, move_window=5, move_min=5, stim_time=50):
+    """
+    Finds the first bin after stim_time starting a window of move_window bins in
+    which the peak-to-peak wheel position exceeds move_min, or stim_time if there
+    is none.
+
+    The windowed peak-to-peak is computed from running maximum and minimum
+    positions, without gathering every window, for any number of trials (and
+    sessions) at once.
+
+    Arguments:
+    wheel -- array of wheel positions of shape (..., bins)
+
+    Keyword Arguments:
+    move_window -- sliding window size in which movement will be searched
+    move_min -- minimum amount of peak-to-peak wheel movement required in window
+    stim_time -- bin number of stimulus presentation
+
+    Returns an array of onset bins of shape wheel.shape[:-1].
+    """
+    # Windows never include the last bin, as before
+    wheel = wheel[..., stim_time : wheel.shape[-1] - 1]
+    peak_to_peak = _running(wheel, move_window, np.maximum) - _running(
+        wheel, move_window, np.minimum
+    )
+    return (peak_to_peak > move_min).argmax(axis=-1) + stim_time
+
+
+def check_movement_onsets(onsets, reaction_time, stim_time=50, tolerance=5):
+    """
+    Returns whether each movement onset is within tolerance bins of the onset
+    given by session["reaction_time"], or True if the trial has no reaction time.
+    """
+    reaction_onsets = reaction_time[..., 0] / 10 + stim_time
+    has_reaction = np.isfinite(reaction_onsets)
+    agrees = np.ones(onsets.shape, dtype=bool)
+    agrees[has_reaction] = (
+        np.abs(onsets[has_reaction] - reaction_onsets[has_reaction]) <= tolerance
+    )
+    return agrees
+
+
 def get_action_times(
     wheel,
     response_time,
@@ -11,6 +68,8 @@ def get_action_times(
     move_window=5,
     stim_time=50,
     stim_buffer=20,
+    reaction_time=None,
+    tolerance=5,
 ):
     """
     DEPRECTATED: Use session['reaction_time'] instead
@@ -19,7 +78,7 @@ def get_action_times(
 
     Movement time is determined by taking the peak-to-peak wheel position in
     a sliding leading window to find the time bin initiating a large, sustained
-    movement.
+    movement (see get_movement_onsets).
 
     Returns an array of size num_trials x (bin_before + bins_after).
     The returned indices are guaranteed to fit within the available sessiona, (i.e.
@@ -39,62 +98,265 @@ def get_action_times(
     move_min -- minimum amount of peak-to-peak wheel movement required in window
     stim_time -- bin number of stimulus presentation
     stim_buffer -- number of mansessionory "no movement" bins before stim_time
+    reaction_time -- session['reaction_time'] to cross-check movement times
+        with, trials where they disagree use the reaction time instead
+    tolerance -- number of bins by which movement and reaction times may differ
     """
-    num_bins = wheel.shape[2]
-    windows = np.arange(stim_time, num_bins - move_window)[:, np.newaxis] + np.arange(
-        move_window
+    action_time = get_movement_onsets(
+        wheel[0], move_window=move_window, move_min=move_min, stim_time=stim_time
     )
-    is_moving = np.ptp(wheel[0][:, windows], axis=2) > move_min
-    action_time = is_moving.argmax(axis=1) + stim_time
+    if reaction_time is not None:
+        agrees = check_movement_onsets(
+            action_time, reaction_time, stim_time=stim_time, tolerance=tolerance
+        )
+        action_time[~agrees] = reaction_time[~agrees, 0] / 10 + stim_time
 
     # Fit within available window
     min_time = stim_time - stim_buffer
     action_time = np.maximum(action_time, min_time + bins_before)
 
-    max_time = (response_time / 0.01).astype(np.int).flatten() + stim_time
+    max_time = (response_time / 0.01).astype(int).flatten() + stim_time
     action_time = np.minimum(action_time, max_time - bins_after)
 
     return action_time[np.newaxis, :, np.newaxis] + np.arange(-bins_before, bins_after)
 
 
+def get_all_action_times(sessions, cross_check=False, **kwargs):
+    """
+    Runs get_action_times on the trials of all sessions at once, returning a
+    list of each session's action times. Sessions must have the same number of
+    bins.
+
+    Arguments:
+    sessions -- iterable of sessions
+
+    Keyword Arguments:
+    cross_check -- pass each session's reaction_time to get_action_times
+    kwargs -- passed to get_action_times
+    """
+    sessions = list(sessions)
+    num_trials = [session["response_time"].shape[0] for session in sessions]
+    if cross_check:
+        kwargs["reaction_time"] = np.concatenate(
+            [session["reaction_time"] for session in sessions]
+        )
+    action_times = get_action_times(
+        np.concatenate([session["wheel"] for session in sessions], axis=1),
+        np.concatenate([session["response_time"] for session in sessions]),
+        **kwargs,
+    )
+    return np.split(action_times, np.cumsum(num_trials)[:-1], axis=1)
+
+
+SELECTORS = {}
+
+
+def register_selector(name):
+    """
+    Decorator registering a selector function under name. The function is called
+    as func(session, selector) the first time the selector is requested, where
+    selector gives access to the session's other selectors.
+    """
+
+    def decorator(func):
+        SELECTORS[name] = func
+        return func
+
+    return decorator
+
+
+class Selectors(MutableMapping):
+    """
+    Lazily computed selectors of a session. Each selector is computed the first
+    time it is requested and kept, boolean masks as packed bits.
+
+    Besides the registered names, a selector can be a boolean expression of
+    other selectors using &, |, ^ and ~, e.g. "STIM_LEFT & CHOICE_CORRECT".
+
+    Arguments:
+    session -- session to compute the selectors of
+
+    Keyword Arguments:
+    registry -- selector functions by name
+    """
+
+    def __init__(self, session, registry=SELECTORS):
+        self.session = session
+        self.registry = registry
+        self._values = {}
+
+    def _store(self, name, value):
+        value = np.asarray(value)
+        if value.dtype == bool:
+            value = (np.packbits(value), value.shape)
+        self._values[name] = value
+
+    def _load(self, name):
+        value = self._values[name]
+        if type(value) is tuple:
+            packed, shape = value
+            count = int(np.prod(shape))
+            return np.unpackbits(packed, count=count).view(bool).reshape(shape)
+        return value
+
+    def __getitem__(self, name):
+        if name not in self._values:
+            if name in self.registry:
+                self._store(name, self.registry[name](self.session, self))
+            else:
+                return self.evaluate(name)
+        return self._load(name)
+
+    def __setitem__(self, name, value):
+        self._store(name, value)
+
+    def __delitem__(self, name):
+        del self._values[name]
+
+    def __iter__(self):
+        # Names starting with an underscore are helpers for other selectors
+        names = dict.fromkeys(self.registry)
+        names.update(dict.fromkeys(self._values))
+        return (name for name in names if not name.startswith("_"))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, name):
+        return name in self.registry or name in self._values
+
+    def evaluate(self, expression):
+        """Evaluates a boolean expression of selector names"""
+        try:
+            tree = ast.parse(expression, mode="eval")
+        except SyntaxError:
+            raise KeyError(expression)
+        return self._evaluate(tree.body, expression)
+
+    def _evaluate(self, node, expression):
+        if isinstance(node, ast.Name):
+            if node.id not in self:
+                raise KeyError(node.id)
+            return self[node.id]
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Invert):
+            return ~self._evaluate(node.operand, expression)
+        if isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+            return _OPERATORS[type(node.op)](
+                self._evaluate(node.left, expression),
+                self._evaluate(node.right, expression),
+            )
+        raise ValueError(f"Invalid selector expression {expression}")
+
+
+_OPERATORS = {
+    ast.BitAnd: np.logical_and,
+    ast.BitOr: np.logical_or,
+    ast.BitXor: np.logical_xor,
+}
+
+_selectors = weakref.WeakKeyDictionary()
+
+
 def get_selectors(session):
-    no_movement = np.ptp(session["wheel"][0], 1) < 3
-    selector = {
-        "NEURON_VISUAL": np.isin(session["brain_area"], AREAS_VISUAL),
-        "NEURON_MOTOR": np.isin(session["brain_area"], AREAS_MOTOR),
-        "NEURON_ACTION": np.isin(session["brain_area"], AREAS_ACTION),
-        "CHOICE_RIGHT": (session["response"] == -1) & (~no_movement),
-        "CHOICE_LEFT": (session["response"] == 1) & (~no_movement),
-        "CHOICE_NONE": (session["response"] == 0) | (no_movement),
-        "STIM_RIGHT": session["contrast_right"] > session["contrast_left"],
-        "STIM_LEFT": session["contrast_right"] < session["contrast_left"],
-        "STIM_EQUAL": (session["contrast_right"] == session["contrast_left"])
-        & (session["contrast_right"] > 0),
-        "STIM_NONE": (session["contrast_right"] == session["contrast_left"])
-        & (session["contrast_right"] == 0),
-        "STIM_RIGHT_HIGH": session["contrast_right"] == 1,
-        "STIM_RIGHT_MEDIUM": session["contrast_right"] == 0.5,
-        "STIM_RIGHT_LOW": session["contrast_right"] == 0.25,
-        "STIM_RIGHT_NONE": session["contrast_right"] == 0,
-        "TIMES_ACTION": get_action_times(
-            session["wheel"],
-            session["response_time"],
-            bins_before=20,
-            bins_after=5,
-            move_window=4,
-            move_min=2,
-            stim_time=50,
-            stim_buffer=20,
-        ),
-    }
-    selector.update(
-        {
-            "CHOICE_CORRECT": (
-                (selector["STIM_RIGHT"] & selector["CHOICE_RIGHT"])
-                | (selector["STIM_LEFT"] & selector["CHOICE_LEFT"])
-                | (selector["STIM_NONE"] & selector["CHOICE_NONE"])
-            ),
-            "CHOICE_MISS": ~selector["STIM_NONE"] & selector["CHOICE_NONE"],
-        }
+    """
+    Returns the Selectors of a session, shared between calls for the same
+    Session object so each selector is only computed once per session.
+    """
+    try:
+        if session not in _selectors:
+            _selectors[session] = Selectors(session)
+        return _selectors[session]
+    except TypeError:
+        # Plain dict sessions can't be weakly referenced
+        return Selectors(session)
+
+
+def _register_area_selector(name, areas):
+    register_selector(name)(lambda session, _: np.isin(session["brain_area"], areas))
+
+
+_register_area_selector("NEURON_VISUAL", AREAS_VISUAL)
+_register_area_selector("NEURON_MOTOR", AREAS_MOTOR)
+_register_area_selector("NEURON_ACTION", AREAS_ACTION)
+
+
+@register_selector("_NO_MOVEMENT")
+def _no_movement(session, _):
+    return np.ptp(session["wheel"][0], 1) < 3
+
+
+@register_selector("CHOICE_RIGHT")
+def _choice_right(session, selector):
+    return (session["response"] == -1) & (~selector["_NO_MOVEMENT"])
+
+
+@register_selector("CHOICE_LEFT")
+def _choice_left(session, selector):
+    return (session["response"] == 1) & (~selector["_NO_MOVEMENT"])
+
+
+@register_selector("CHOICE_NONE")
+def _choice_none(session, selector):
+    return (session["response"] == 0) | (selector["_NO_MOVEMENT"])
+
+
+@register_selector("STIM_RIGHT")
+def _stim_right(session, _):
+    return session["contrast_right"] > session["contrast_left"]
+
+
+@register_selector("STIM_LEFT")
+def _stim_left(session, _):
+    return session["contrast_right"] < session["contrast_left"]
+
+
+@register_selector("STIM_EQUAL")
+def _stim_equal(session, _):
+    return (session["contrast_right"] == session["contrast_left"]) & (
+        session["contrast_right"] > 0
+    )
+
+
+@register_selector("STIM_NONE")
+def _stim_none(session, _):
+    return (session["contrast_right"] == session["contrast_left"]) & (
+        session["contrast_right"] == 0
     )
-    return selector
+
+
+def _register_contrast_selector(name, contrast):
+    register_selector(name)(lambda session, _: session["contrast_right"] == contrast)
+
+
+_register_contrast_selector("STIM_RIGHT_HIGH", 1)
+_register_contrast_selector("STIM_RIGHT_MEDIUM", 0.5)
+_register_contrast_selector("STIM_RIGHT_LOW", 0.25)
+_register_contrast_selector("STIM_RIGHT_NONE", 0)
+
+
+@register_selector("TIMES_ACTION")
+def _times_action(session, _):
+    return get_action_times(
+        session["wheel"],
+        session["response_time"],
+        bins_before=20,
+        bins_after=5,
+        move_window=4,
+        move_min=2,
+        stim_time=50,
+        stim_buffer=20,
+    )
+
+
+@register_selector("CHOICE_CORRECT")
+def _choice_correct(session, selector):
+    return (
+        (selector["STIM_RIGHT"] & selector["CHOICE_RIGHT"])
+        | (selector["STIM_LEFT"] & selector["CHOICE_LEFT"])
+        | (selector["STIM_NONE"] & selector["CHOICE_NONE"])
+    )
+
+
+@register_selector("CHOICE_MISS")
+def _choice_miss(session, selector):
+    return ~selector["STIM_NONE"] & selector["CHOICE_NONE"]
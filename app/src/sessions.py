@@ -0,0 +1,276 @@
+import numpy as np
+from collections import OrderedDict
+from .area_index import load_area_index
+from .sparse import SparseSpikes
+
+
+def _field(key):
+    return property(lambda self: self[key], doc=f'Lazily loaded session["{key}"]')
+
+
+class Session:
+    """
+    A single recording session backed by the on-disk session cache.
+
+    Fields are only loaded (memory-mapped by default) the first time they are
+    accessed, either as attributes (session.spks) or by key (session["spks"]),
+    so a Session can be passed anywhere a session dict is expected.
+
+    Arguments:
+    number -- session number within the dataset
+
+    Keyword Arguments:
+    session_dir -- cache directory holding one <field>.npy file per field
+    info -- index entry describing the session's fields and attributes
+    mmap_mode -- passed to np.load, None loads fields fully into memory
+    sparse -- load spks as SparseSpikes, converting it on first use
+    fields -- already loaded fields, e.g. when wrapping a session dict
+    on_load -- called with the session whenever a field is loaded
+    on_access -- called with the session whenever an already loaded field is
+        read
+    """
+
+    __slots__ = (
+        "number",
+        "_dir",
+        "_info",
+        "_mmap_mode",
+        "_sparse",
+        "_fields",
+        "_on_load",
+        "_on_access",
+        "__weakref__",
+    )
+
+    spks = _field("spks")
+    wheel = _field("wheel")
+    pupil = _field("pupil")
+    brain_area = _field("brain_area")
+    contrast_left = _field("contrast_left")
+    contrast_right = _field("contrast_right")
+    response = _field("response")
+    response_time = _field("response_time")
+    reaction_time = _field("reaction_time")
+    feedback_type = _field("feedback_type")
+    feedback_time = _field("feedback_time")
+    gocue = _field("gocue")
+
+    def __init__(
+        self,
+        number,
+        session_dir=None,
+        info=None,
+        mmap_mode="r",
+        sparse=False,
+        fields=None,
+        on_load=None,
+        on_access=None,
+    ):
+        self.number = number
+        self._dir = session_dir
+        self._info = info if info is not None else {"fields": {}, "attrs": {}}
+        self._mmap_mode = mmap_mode
+        self._sparse = sparse
+        self._fields = dict(fields) if fields is not None else {}
+        self._on_load = on_load
+        self._on_access = on_access
+
+    @classmethod
+    def from_dict(cls, number, session):
+        return cls(number, fields=session)
+
+    def __repr__(self):
+        return f"Session({self.number})"
+
+    @property
+    def key(self):
+        """
+        Identifies the cached data backing this session, changes whenever the
+        session cache is rebuilt. None for sessions not backed by the cache.
+        """
+        if self._dir is None:
+            return None
+        stat = (self._dir / "spks.npy").stat()
+        return f"{self._dir.resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            if self._on_access is not None:
+                self._on_access(self)
+            return self._fields[key]
+        if key in self._info["attrs"]:
+            return self._info["attrs"][key]
+        if key not in self._info["fields"]:
+            raise KeyError(key)
+
+        if key == "spks" and self._sparse:
+            value = self._load_sparse(key)
+        else:
+            field = self._info["fields"][key]
+            value = np.load(
+                self._dir / f"{key}.npy",
+                mmap_mode=self._mmap_mode if field["mmap"] else None,
+                allow_pickle=not field["mmap"],
+            )
+        self._fields[key] = value
+        if self._on_load is not None:
+            self._on_load(self)
+        return value
+
+    def _load_sparse(self, key):
+        if not SparseSpikes.exists(self._dir, key):
+            dense = np.load(self._dir / f"{key}.npy", mmap_mode="r")
+            SparseSpikes.from_dense(dense).save(self._dir, key)
+        return SparseSpikes.load(self._dir, key, mmap_mode=self._mmap_mode)
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return set(self._fields) | set(self._info["fields"]) | set(self._info["attrs"])
+
+    def items(self):
+        return ((key, self[key]) for key in self.keys())
+
+    @property
+    def nbytes(self):
+        """Size of the currently loaded fields"""
+        return sum(
+            value.nbytes
+            for value in self._fields.values()
+            if isinstance(value, (np.ndarray, SparseSpikes))
+        )
+
+    def load(self):
+        """Loads every field up front"""
+        for key in self._info["fields"]:
+            self[key]
+        return self
+
+    def release(self):
+        """Drops loaded fields, they will be reloaded on next access"""
+        if self._dir is not None:
+            self._fields.clear()
+
+
+class SessionCollection:
+    """
+    Sessions loaded on demand from the on-disk session cache.
+
+    Loaded sessions are kept in an LRU, and the least recently used sessions
+    are released once the size of their loaded fields exceeds max_bytes. This
+    bounds memory when streaming through every session in turn.
+
+    Arguments:
+    cache_dir -- session cache directory
+    index -- session cache index
+
+    Keyword Arguments:
+    mmap_mode -- passed to np.load, None loads fields fully into memory
+    max_bytes -- budget for loaded fields, None for unbounded
+    sparse -- load spks as SparseSpikes
+    """
+
+    def __init__(self, cache_dir, index, mmap_mode="r", max_bytes=None, sparse=False):
+        self.cache_dir = cache_dir
+        self.index = index
+        self.max_bytes = max_bytes
+        self.numbers = np.arange(len(index["sessions"]))
+        self._root = self
+        self._loaded = OrderedDict()
+        self._area_index = None
+        self._sessions = [
+            Session(
+                number,
+                session_dir=cache_dir / f"{number:02d}",
+                info=info,
+                mmap_mode=mmap_mode,
+                sparse=sparse,
+                on_load=self._on_load,
+                on_access=self._on_access,
+            )
+            for number, info in enumerate(index["sessions"])
+        ]
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __iter__(self):
+        return (self._root._sessions[number] for number in self.numbers)
+
+    def __getitem__(self, i):
+        if isinstance(i, (int, np.integer)):
+            return self._root._sessions[self.numbers[i]]
+        return self._subset(self.numbers[i])
+
+    def __repr__(self):
+        return f"SessionCollection({list(self.numbers)})"
+
+    @property
+    def loaded_bytes(self):
+        return sum(session.nbytes for session in self._root._loaded.values())
+
+    @property
+    def area_index(self):
+        """AreaIndex of all sessions, stored in the session cache"""
+        root = self._root
+        if root._area_index is None:
+            root._area_index = load_area_index(root.cache_dir, root._sessions)
+        return root._area_index
+
+    def _subset(self, numbers):
+        subset = object.__new__(SessionCollection)
+        subset.__dict__.update(self.__dict__)
+        subset.numbers = np.atleast_1d(numbers)
+        return subset
+
+    def _on_access(self, session):
+        # Reading a loaded field makes its session the most recently used
+        loaded = self._root._loaded
+        if session.number in loaded:
+            loaded.move_to_end(session.number)
+
+    def _on_load(self, session):
+        loaded = self._root._loaded
+        loaded[session.number] = session
+        loaded.move_to_end(session.number)
+        if self.max_bytes is None:
+            return
+
+        total = self.loaded_bytes
+        while total > self.max_bytes and len(loaded) > 1:
+            _, evicted = loaded.popitem(last=False)
+            total -= evicted.nbytes
+            evicted.release()
+
+    def load(self):
+        """Loads every session up front"""
+        for session in self:
+            session.load()
+        return self
+
+    def filter(self, by_area=None, predicate=None):
+        """
+        Returns the sessions recording from any of the given brain areas and/or
+        matching the given predicate.
+
+        Keyword Arguments:
+        by_area -- area or group name (e.g. VISUAL), or list of either (e.g.
+            AREAS_VISUAL)
+        predicate -- callable taking a Session and returning a bool
+        """
+        numbers = self.numbers
+        if by_area is not None:
+            counts = self.area_index.counts(by_area)
+            numbers = [number for number in numbers if number in counts]
+        if predicate is not None:
+            numbers = [
+                number for number in numbers if predicate(self._root._sessions[number])
+            ]
+        return self._subset(np.array(numbers, dtype=int))
@@ -0,0 +1,142 @@
+import numpy as np
+from scipy import fft, ndimage, signal
+
+
+# Above this many non-zero taps, FFT convolution beats ndimage's direct one
+FFT_MIN_TAPS = 16
+# FFT convolution needs several times the memory of ndimage's, so "auto" only
+# uses it while its working arrays fit in this many bytes
+FFT_MAX_BYTES = 1 << 28
+
+
+def half_gaussian_kernel(size, std):
+    """Gaussian kernel with the taps after the center zeroed out"""
+    kernel = signal.windows.gaussian(size, std)
+    kernel[size // 2 + 1 :] = 0
+    return kernel
+
+
+def exponential_kernel(size, tau):
+    """Exponential kernel decaying away from the center, in bins of tau"""
+    center = size // 2
+    kernel = np.zeros(size)
+    kernel[: center + 1] = np.exp(-np.arange(center, -1, -1) / tau)
+    return kernel
+
+
+def boxcar_kernel(size):
+    """Flat kernel over the taps up to and including the center"""
+    kernel = np.zeros(size)
+    kernel[: size // 2 + 1] = 1
+    return kernel
+
+
+def get_kernel(smoothing):
+    """
+    Converts the smoothing argument of get_spikes into kernel weights. It is
+    either the (size, std) of a half-Gaussian kernel, as a tuple or list, or an
+    array of kernel weights.
+    """
+    if isinstance(smoothing, np.ndarray):
+        return smoothing.astype(np.float64, copy=False)
+    return half_gaussian_kernel(*smoothing)
+
+
+def _fft_bytes(spikes, kernel):
+    # Real input and output of the padded transform plus its complex spectrum
+    rows = np.prod(spikes.shape[:-1])
+    return 3 * 8 * rows * fft.next_fast_len(spikes.shape[-1] + len(kernel) - 1)
+
+
+def _smooth_shift(spikes, kernel, out):
+    num_bins = spikes.shape[-1] - len(kernel) + 1
+    out[...] = 0
+    scratch = np.empty(out.shape)
+    for tap in np.flatnonzero(kernel):
+        shift = len(kernel) - tap - 1
+        np.multiply(spikes[..., shift : shift + num_bins], kernel[tap], out=scratch)
+        out += scratch
+    return out
+
+
+def _smooth_iir(spikes, kernel):
+    center = len(kernel) // 2
+    taps = kernel[: center + 1]
+    ratios = taps[:-1] / taps[1:]
+    if (
+        center == 0
+        or np.any(kernel[center + 1 :])
+        or not np.allclose(ratios, ratios[0])
+    ):
+        raise ValueError("IIR smoothing requires an exponential kernel")
+
+    # Untruncated exponential as a first order filter, run backwards in time to
+    # match the orientation of the kernel
+    smoothed = signal.lfilter([taps[-1]], [1, -ratios[0]], spikes[..., ::-1], axis=-1)[
+        ..., ::-1
+    ]
+    num_bins = spikes.shape[-1] - len(kernel) + 1
+    start = len(kernel) - center - 1
+    return smoothed[..., start : start + num_bins]
+
+
+def smooth(spikes, kernel, method="auto", out=None):
+    """
+    Convolves spikes with kernel along the last (bin) axis, keeping only the
+    bins where the kernel fully overlaps the input, like
+    signal.convolve(..., mode="valid"). All neurons and trials are smoothed at
+    once.
+
+    Arguments:
+    spikes -- array of shape (neurons, trials, bins)
+    kernel -- 1D kernel weights
+
+    Keyword Arguments:
+    method -- one of
+        "direct": signal.convolve with method="direct"
+        "ndimage": ndimage.convolve1d along the bin axis
+        "shift": shift-and-add over the non-zero kernel taps, which writes
+            straight into out without allocating the result
+        "fft": FFT convolution along the bin axis
+        "iir": recursive filter approximating an (untruncated) exponential kernel
+        "auto": "fft" for long kernels as long as it needs less than
+            FFT_MAX_BYTES, "ndimage" otherwise
+    out -- array to write the smoothed spikes to
+
+    Returns an array of shape (neurons, trials, bins - len(kernel) + 1).
+    """
+    if method == "auto":
+        use_fft = (
+            np.count_nonzero(kernel) > FFT_MIN_TAPS
+            and _fft_bytes(spikes, kernel) <= FFT_MAX_BYTES
+        )
+        method = "fft" if use_fft else "ndimage"
+
+    if method == "shift":
+        if out is None:
+            out = np.empty(spikes.shape[:-1] + (spikes.shape[-1] - len(kernel) + 1,))
+        return _smooth_shift(spikes, kernel, out)
+
+    if method == "direct":
+        smoothed = signal.convolve(
+            spikes, kernel[np.newaxis, np.newaxis, :], mode="valid", method="direct",
+        )
+    elif method == "ndimage":
+        start = (len(kernel) - 1) // 2
+        smoothed = ndimage.convolve1d(
+            spikes, kernel, axis=-1, output=np.float64, mode="constant"
+        )
+        smoothed = smoothed[..., start : start + spikes.shape[-1] - len(kernel) + 1]
+    elif method == "fft":
+        smoothed = signal.fftconvolve(
+            spikes, kernel[np.newaxis, np.newaxis, :], mode="valid", axes=-1
+        )
+    elif method == "iir":
+        smoothed = _smooth_iir(spikes, kernel)
+    else:
+        raise ValueError(f"Unknown smoothing method {method}")
+
+    if out is not None:
+        out[...] = smoothed
+        return out
+    return smoothed
@@ -0,0 +1,155 @@
+import numpy as np
+import os
+
+
+SPARSE_PARTS = ("indptr", "bins", "counts")
+
+
+def as_indices(selector):
+    """Converts a boolean mask or index array into an index array"""
+    selector = np.asarray(selector)
+    if selector.dtype == bool:
+        return np.flatnonzero(selector)
+    return selector.astype(int, copy=False)
+
+
+def _save_atomic(path, array):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+class SparseSpikes:
+    """
+    Spike counts of a neurons x trials x bins tensor stored in CSR format.
+
+    Each (neuron, trial) pair is a row, holding the sorted bin numbers with
+    non-zero counts and the counts themselves. Since most 10ms bins are empty,
+    this is much smaller than the dense tensor, and windows of it can be
+    extracted without densifying anything outside the window.
+
+    Arguments:
+    indptr -- row offsets into bins and counts, of length neurons * trials + 1
+    bins -- bin number of each non-zero count
+    counts -- non-zero spike counts
+    shape -- shape of the dense tensor
+    """
+
+    def __init__(self, indptr, bins, counts, shape):
+        self.indptr = indptr
+        self.bins = bins
+        self.counts = counts
+        self.shape = tuple(shape)
+
+    def __repr__(self):
+        return f"SparseSpikes(shape={self.shape}, nnz={len(self.counts)})"
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def dtype(self):
+        return self.counts.dtype
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.bins.nbytes + self.counts.nbytes
+
+    @classmethod
+    def from_dense(cls, spks, chunk_size=64):
+        """Converts a dense spike tensor, chunk_size neurons at a time"""
+        num_neurons, num_trials, num_bins = spks.shape
+        bin_dtype = np.min_scalar_type(num_bins - 1)
+
+        rows, bins, counts = [], [], []
+        for start in range(0, num_neurons, chunk_size):
+            chunk = np.asarray(spks[start : start + chunk_size])
+            chunk = chunk.reshape(-1, num_bins)
+            chunk_rows, chunk_bins = np.nonzero(chunk)
+            rows.append(chunk_rows + start * num_trials)
+            bins.append(chunk_bins.astype(bin_dtype))
+            counts.append(chunk[chunk_rows, chunk_bins])
+
+        rows = np.concatenate(rows)
+        indptr = np.zeros(num_neurons * num_trials + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=num_neurons * num_trials), out=indptr[1:])
+        return cls(indptr, np.concatenate(bins), np.concatenate(counts), spks.shape)
+
+    def save(self, directory, name="spks"):
+        # Every file is written to a temp name and moved into place, and the shape
+        # file that exists checks for goes last, so an interrupted save never
+        # leaves a tensor that looks complete
+        for part in SPARSE_PARTS:
+            _save_atomic(directory / f"{name}.{part}.npy", getattr(self, part))
+        _save_atomic(directory / f"{name}.shape.npy", np.array(self.shape))
+
+    @classmethod
+    def load(cls, directory, name="spks", mmap_mode="r"):
+        return cls(
+            *[
+                np.load(directory / f"{name}.{part}.npy", mmap_mode=mmap_mode)
+                for part in SPARSE_PARTS
+            ],
+            shape=np.load(directory / f"{name}.shape.npy"),
+        )
+
+    @classmethod
+    def exists(cls, directory, name="spks"):
+        return os.path.isfile(directory / f"{name}.shape.npy")
+
+    @classmethod
+    def remove(cls, directory, name="spks"):
+        """Deletes a saved tensor, e.g. when the dense tensor it came from changes"""
+        for part in ("shape", *SPARSE_PARTS):
+            path = directory / f"{name}.{part}.npy"
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def window(self, neurons, trials, starts, width, out=None):
+        """
+        Densifies only the requested window of the tensor.
+
+        Arguments:
+        neurons -- boolean mask or indices of neurons
+        trials -- boolean mask or indices of trials
+        starts -- first bin of the window, either a scalar or one per trial
+        width -- number of bins in the window
+
+        Keyword Arguments:
+        out -- C-contiguous array of shape (neurons, trials, width) to write the
+            window to
+
+        Returns an array of shape (neurons, trials, width).
+        """
+        num_neurons, num_trials, _ = self.shape
+        neurons = as_indices(neurons)
+        trials = as_indices(trials)
+        starts = np.broadcast_to(np.asarray(starts).ravel(), (len(trials),))
+
+        if out is None:
+            out = np.zeros((len(neurons), len(trials), width), dtype=self.dtype)
+        else:
+            out[...] = 0
+
+        rows = (neurons[:, np.newaxis] * num_trials + trials).ravel()
+        row_starts = self.indptr[rows]
+        row_lengths = self.indptr[rows + 1] - row_starts
+
+        # Gather the non-zero entries of every selected row at once
+        row_ids = np.repeat(np.arange(len(rows)), row_lengths)
+        offsets = np.cumsum(row_lengths) - row_lengths
+        entries = np.arange(len(row_ids)) - offsets[row_ids] + row_starts[row_ids]
+
+        window_bins = self.bins[entries] - np.tile(starts, len(neurons))[row_ids]
+        in_window = (window_bins >= 0) & (window_bins < width)
+
+        out.reshape(-1, width)[
+            row_ids[in_window], window_bins[in_window]
+        ] = self.counts[entries[in_window]]
+        return out
+
+    def toarray(self):
+        num_neurons, num_trials, num_bins = self.shape
+        return self.window(np.arange(num_neurons), np.arange(num_trials), 0, num_bins)
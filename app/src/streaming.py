@@ -0,0 +1,104 @@
+import numpy as np
+import time
+from collections import namedtuple
+
+
+Decision = namedtuple("Decision", ["trial", "decision", "bin"])
+
+
+class StreamingDecoder:
+    """
+    Bin-by-bin version of decoding.decode for many concurrent trials.
+
+    Each call to update takes one bin of population activity, updates the
+    log-posteriors of every trial with the same recursion as decode, and returns
+    a Decision for each trial whose posterior crossed its threshold for the first
+    time. The work per bin only depends on the number of neurons, trials and
+    classes, not on how many bins came before.
+
+    Unlike decode, which picks the highest class to cross its threshold at any
+    point in the trial, a trial's decision is final as soon as any class crosses.
+    As in decode, a class already above its threshold in the first bin is never
+    decided for that trial.
+
+    Arguments:
+    clf -- fitted classifier with predict_log_proba, e.g. a LinearDecoder
+    threshold -- posterior threshold of each class but the first
+    num_trials -- number of concurrent trials
+    """
+
+    def __init__(self, clf, threshold, num_trials):
+        self.clf = clf
+        self.threshold = np.atleast_1d(threshold)
+        self.num_trials = num_trials
+        self.reset()
+
+    def reset(self):
+        self.bin = 0
+        self.log_posteriors = None
+        self._eligible = None
+        self.decisions = np.zeros((self.num_trials, 2), int)
+
+    @property
+    def posteriors(self):
+        return np.exp(self.log_posteriors)
+
+    def update(self, activity):
+        """
+        Arguments:
+        activity -- population activity of one bin, of shape (neurons, trials)
+
+        Returns a list of Decisions made in this bin.
+        """
+        likelihoods = self.clf.predict_log_proba(activity.T)
+        if self.log_posteriors is None:
+            self.log_posteriors = likelihoods
+        else:
+            prob = np.exp(self.log_posteriors + likelihoods) + np.finfo(np.float64).eps
+            self.log_posteriors = np.log(prob / prob.sum(axis=1, keepdims=True))
+
+        crossed = self.posteriors[:, 1:] > self.threshold
+        events = []
+        if self.bin == 0:
+            self._eligible = ~crossed
+        else:
+            crossed &= self._eligible
+            is_new = crossed.any(axis=1) & (self.decisions[:, 0] == 0)
+            # The highest class that crossed its threshold, as in decode
+            decision = crossed.shape[1] - np.argmax(crossed[:, ::-1], axis=1)
+            for trial in np.flatnonzero(is_new):
+                self.decisions[trial] = [decision[trial], self.bin]
+                events.append(Decision(trial, decision[trial], self.bin))
+
+        self.bin += 1
+        return events
+
+
+def replay(decoder, spikes, bin_size=0.01, realtime=False):
+    """
+    Feeds recorded spikes to a StreamingDecoder one bin at a time.
+
+    Arguments:
+    decoder -- StreamingDecoder
+    spikes -- array of shape (neurons, trials, bins)
+
+    Keyword Arguments:
+    bin_size -- duration of a bin in seconds
+    realtime -- wait for each bin's time to come before processing it
+
+    Returns the list of Decisions and the processing latency of each bin in
+    seconds.
+    """
+    num_bins = spikes.shape[2]
+    events = []
+    latencies = np.zeros(num_bins)
+
+    start = time.perf_counter()
+    for i in range(num_bins):
+        if realtime:
+            time.sleep(max(0, start + i * bin_size - time.perf_counter()))
+        bin_start = time.perf_counter()
+        events.extend(decoder.update(spikes[:, :, i]))
+        latencies[i] = time.perf_counter() - bin_start
+
+    return events, latencies
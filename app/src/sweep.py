@@ -0,0 +1,404 @@
+import functools
+import itertools
+import numpy as np
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from sklearn.linear_model import LogisticRegression
+from . import brain_areas
+from .cache import SpikeCache
+from .data import get_spikes, load_sessions, save_decoder_results
+from .decoding import cv_and_fit, decode
+from .permutation import permutation_test
+from .results import open_results
+from .selectors import get_selectors
+
+
+DEFAULT_SMOOTHING = (17, 2.5)
+DEFAULT_CLF_PARAMS = {"penalty": "l2", "solver": "saga", "max_iter": 5000}
+SPIKE_CACHE_DIR = "spikes"
+
+Job = namedtuple("Job", ["session", "area", "task", "bins", "smoothing", "clf_params"])
+
+
+def get_area_group(area):
+    """Returns the list of areas for a group name from brain_areas, e.g. VISUAL"""
+    return getattr(brain_areas, f"AREAS_{area.upper()}")
+
+
+def vision_task(session, selector):
+    """
+    Decode stimulus contrast on the right, using a third as many no-stim trials.
+    As in 3-decoders.ipynb, the decoder is one-vs-rest and its threshold for each
+    contrast is the mouse's accuracy at that contrast.
+    """
+    trials = ~selector["STIM_RIGHT_NONE"]
+    num_no_stim = trials.sum() // 3
+    no_stim_trials = ~trials
+    no_stim_trials[no_stim_trials.cumsum() > num_no_stim] = False
+    trials |= no_stim_trials
+
+    _, labels = np.unique(session["contrast_right"], return_inverse=True)
+    return {
+        "trials": trials,
+        "labels": labels,
+        "class_names": ["None", "Low", "Medium", "High"],
+        "bins": (0, 100),
+        "align": 50,
+        "decode_bins": (0, 100),
+        "clf_params": {"multi_class": "ovr"},
+        "threshold": np.array(
+            [
+                selector["CHOICE_CORRECT"][selector[f"STIM_RIGHT_{level}"]].mean()
+                for level in ["LOW", "MEDIUM", "HIGH"]
+            ]
+        ),
+    }
+
+
+def action_task(session, selector):
+    """
+    Decode go vs. no-go around the reaction time, using as many go trials. The
+    decoder's threshold comes from its cross-validated confusion matrix.
+    """
+    trials = np.copy(selector["CHOICE_NONE"])
+    trials[np.where(~trials)[0][: trials.sum()]] = True
+    labels = 1 - selector["CHOICE_NONE"]
+
+    reaction_times = session["reaction_time"][trials, 0] / 10
+    no_response = np.isinf(reaction_times)
+    reaction_times[no_response] = reaction_times[~no_response].mean()
+    reaction_times = reaction_times.astype(int)
+
+    return {
+        "trials": trials,
+        "labels": labels,
+        "class_names": ["NoGo", "Go"],
+        "bins": (-20, 20),
+        "align": reaction_times + 50,
+        "decode_bins": (0, 200),
+        "clf_params": {},
+        "threshold": None,
+    }
+
+
+TASKS = {
+    "vision": vision_task,
+    "action": action_task,
+}
+
+
+def get_job_name(job):
+    """Results name of a job, e.g. vision_visual, with any non-default settings"""
+    name = [job.task, job.area.lower()]
+    if job.bins is not None:
+        name.append(f"bins{job.bins[0]}:{job.bins[1]}")
+    if job.smoothing != DEFAULT_SMOOTHING:
+        name.append(f"smoothing{job.smoothing[0]}:{job.smoothing[1]}")
+    name.extend(f"{key}={value}" for key, value in job.clf_params)
+    return "_".join(name)
+
+
+def make_jobs(
+    sessions,
+    areas,
+    tasks=("vision", "action"),
+    bins=(None,),
+    smoothing=(DEFAULT_SMOOTHING,),
+    clf_params=({},),
+):
+    """
+    Expands a grid of decoder settings into jobs, ordered by session.
+
+    Arguments:
+    sessions -- session numbers
+    areas -- area group names from brain_areas, e.g. ["VISUAL", "MOTOR"]
+
+    Keyword Arguments:
+    tasks -- names of decoding tasks in TASKS
+    bins -- training windows, None for the task's default window
+    smoothing -- smoothing arguments passed to get_spikes
+    clf_params -- LogisticRegression parameters overriding DEFAULT_CLF_PARAMS
+        and the task's own parameters
+    """
+    for area in areas:
+        get_area_group(area)
+    return [
+        Job(session, area, task, bins, smoothing, tuple(sorted(params.items())))
+        for session, area, task, bins, smoothing, params in itertools.product(
+            sessions, areas, tasks, bins, smoothing, clf_params
+        )
+    ]
+
+
+def _get_clf(job, task):
+    return LogisticRegression(
+        **{**DEFAULT_CLF_PARAMS, **task["clf_params"], **dict(job.clf_params)}
+    )
+
+
+def run_job(job, session, selector, cache=None):
+    """
+    Cross-validates and fits a decoder for the job, then decodes its trials with
+    the task's threshold, or the cross-validated one if the task has none.
+
+    Keyword Arguments:
+    cache -- SpikeCache, so that jobs only differing in their classifier don't
+        extract the same spikes again
+
+    Returns None if the session has no neurons in the job's areas. The result
+    includes the time taken by each stage, in seconds.
+    """
+    start = time.perf_counter()
+    neurons = np.isin(session["brain_area"], get_area_group(job.area))
+    if not neurons.any():
+        return None
+
+    task = TASKS[job.task](session, selector)
+    clf = _get_clf(job, task)
+    timings = {"setup": time.perf_counter() - start}
+
+    start = time.perf_counter()
+    threshold, _ = cv_and_fit(
+        clf,
+        session,
+        selector,
+        neurons,
+        task["trials"],
+        job.bins if job.bins is not None else task["bins"],
+        task["labels"],
+        task["class_names"],
+        align=task["align"],
+        smoothing=job.smoothing,
+        cache=cache,
+        verbose=False,
+    )
+    if task["threshold"] is not None:
+        threshold = task["threshold"]
+    timings["cv_and_fit"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    spikes = (get_spikes if cache is None else cache.get_spikes)(
+        session,
+        neurons,
+        task["trials"],
+        task["decode_bins"],
+        align=50,
+        smoothing=job.smoothing,
+    )
+    decisions, _ = decode(clf, spikes, threshold)
+    timings["decode"] = time.perf_counter() - start
+
+    return {
+        "trials": task["trials"],
+        "decisions": decisions,
+        "decoder": clf,
+        "threshold": threshold,
+        "timings": timings,
+    }
+
+
+def run_permutation_job(job, session, selector, cache=None, clf=None, seed=0, **kwargs):
+    """
+    Permutation test of the job's cross-validated decoder score, see
+    permutation.permutation_test.
+
+    The shuffles are seeded from seed and the job's session and name, so a job
+    gets the same null distribution whichever sweep it runs in.
+
+    Keyword Arguments:
+    cache -- SpikeCache to extract the job's spikes through
+    clf -- classifier to test, defaults to the job's LogisticRegression. A
+        RidgeClassifier is much faster, as permutations share their fits.
+    seed -- seed of the shuffles
+    kwargs -- passed to permutation_test, e.g. num_permutations
+
+    Returns None if the session has no neurons in the job's areas.
+    """
+    neurons = np.isin(session["brain_area"], get_area_group(job.area))
+    if not neurons.any():
+        return None
+
+    task = TASKS[job.task](session, selector)
+    if clf is None:
+        clf = _get_clf(job, task)
+
+    spikes = (get_spikes if cache is None else cache.get_spikes)(
+        session,
+        neurons,
+        task["trials"],
+        job.bins if job.bins is not None else task["bins"],
+        align=task["align"],
+        smoothing=job.smoothing,
+    )
+    seed = [seed, job.session, *get_job_name(job).encode()]
+    return permutation_test(
+        clf, spikes, task["labels"][task["trials"]], seed=seed, **kwargs
+    )
+
+
+_worker = {}
+
+
+def _init_worker(data_dir, max_bytes, cache_bytes):
+    _worker["sessions"] = load_sessions(data_dir, max_bytes=max_bytes)
+    _worker["selectors"] = (None, None)
+    _worker["cache"] = (
+        None
+        if cache_bytes == 0
+        else SpikeCache(Path(data_dir) / SPIKE_CACHE_DIR, max_bytes=cache_bytes)
+    )
+
+
+def _run_jobs(run, jobs):
+    # Jobs in a chunk share a session, and consecutive chunks usually do too, so
+    # the session and its selectors are only loaded once per worker
+    session_number, selector = _worker["selectors"]
+    session = _worker["sessions"][jobs[0].session]
+    if session_number != jobs[0].session:
+        selector = get_selectors(session)
+        _worker["selectors"] = (jobs[0].session, selector)
+
+    results = []
+    for job in jobs:
+        try:
+            result = run(job, session, selector, cache=_worker["cache"])
+        except Exception:
+            # One failing job shouldn't lose the results of the rest of the sweep
+            result = {"error": traceback.format_exc()}
+        results.append((job, result))
+    return results
+
+
+def _get_chunks(area_index, jobs, chunk_size):
+    # Sessions without neurons in a job's areas have nothing to decode
+    jobs = [
+        job
+        for job in jobs
+        if job.session in area_index.counts(get_area_group(job.area))
+    ]
+
+    chunks = []
+    for _, session_jobs in itertools.groupby(
+        sorted(jobs, key=lambda job: job.session), key=lambda job: job.session
+    ):
+        session_jobs = list(session_jobs)
+        size = chunk_size or len(session_jobs)
+        chunks.extend(
+            session_jobs[i : i + size] for i in range(0, len(session_jobs), size)
+        )
+    return chunks
+
+
+def _map_chunks(run, data_dir, chunks, n_jobs, max_bytes, cache_bytes):
+    with ProcessPoolExecutor(
+        max_workers=n_jobs,
+        initializer=_init_worker,
+        initargs=(data_dir, max_bytes, cache_bytes),
+    ) as executor:
+        futures = {executor.submit(_run_jobs, run, chunk): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            try:
+                results = future.result()
+            except Exception:
+                # e.g. the worker died, leaving none of the chunk's jobs with results
+                error = {"error": traceback.format_exc()}
+                results = [(job, error) for job in futures[future]]
+            yield from results
+
+
+def run_sweep(
+    data_dir,
+    jobs,
+    n_jobs=None,
+    chunk_size=None,
+    skip_complete=True,
+    save=True,
+    max_bytes=None,
+    cache_bytes=None,
+):
+    """
+    Runs decoder jobs over a process pool, yielding (job, result) pairs as they
+    finish. Results are saved with save_decoder_results under get_job_name(job).
+
+    Jobs are grouped by session into chunks that run in a single worker, so a
+    session's data is loaded once per worker. Jobs for sessions without neurons
+    in the job's areas are skipped without being run. A job that raises yields
+    a result holding only its "error" traceback, which isn't saved, and the
+    sweep carries on with the other jobs.
+
+    Arguments:
+    data_dir -- directory holding the sessions and decoder results
+    jobs -- jobs from make_jobs
+
+    Keyword Arguments:
+    n_jobs -- number of worker processes, defaults to the number of CPUs
+    chunk_size -- maximum number of jobs per chunk, None for a chunk per session
+    skip_complete -- skip jobs that already have saved results
+    save -- save results as they finish
+    max_bytes -- per-worker budget for loaded session data
+    cache_bytes -- size limit of the SpikeCache of extracted spikes, shared by
+        the workers under data_dir/spikes. None for unbounded, 0 disables it.
+    """
+    # Builds the session cache up front rather than in every worker
+    area_index = load_sessions(data_dir).area_index
+
+    if skip_complete:
+        results = open_results(data_dir)
+        jobs = [job for job in jobs if (job.session, get_job_name(job)) not in results]
+
+    chunks = _get_chunks(area_index, jobs, chunk_size)
+    for job, result in _map_chunks(
+        run_job, data_dir, chunks, n_jobs, max_bytes, cache_bytes
+    ):
+        if result is not None and "error" not in result and save:
+            start = time.perf_counter()
+            save_decoder_results(
+                data_dir,
+                job.session,
+                result["trials"],
+                get_job_name(job),
+                result["decisions"],
+                result["decoder"],
+                threshold=result["threshold"],
+            )
+            result["timings"]["save"] = time.perf_counter() - start
+        yield job, result
+
+
+def run_permutation_sweep(
+    data_dir,
+    jobs,
+    n_jobs=None,
+    chunk_size=None,
+    max_bytes=None,
+    cache_bytes=None,
+    **kwargs,
+):
+    """
+    Runs run_permutation_job for each job over a process pool, scheduled as in
+    run_sweep.
+
+    Arguments:
+    data_dir -- directory holding the sessions
+    jobs -- jobs from make_jobs
+
+    Keyword Arguments:
+    n_jobs, chunk_size, max_bytes, cache_bytes -- see run_sweep
+    kwargs -- passed to run_permutation_job, e.g. clf, seed or num_permutations
+
+    Returns a {session: {job name: result}} dict of the permutation_test results,
+    with {"error": traceback} for jobs that failed.
+    """
+    area_index = load_sessions(data_dir).area_index
+    run = functools.partial(run_permutation_job, **kwargs)
+
+    results = {}
+    chunks = _get_chunks(area_index, jobs, chunk_size)
+    for job, result in _map_chunks(
+        run, data_dir, chunks, n_jobs, max_bytes, cache_bytes
+    ):
+        results.setdefault(job.session, {})[get_job_name(job)] = result
+    return results
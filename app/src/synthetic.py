@@ -0,0 +1,217 @@
+import numpy as np
+import os
+from pathlib import Path
+from .brain_areas import AREAS_ACTION, AREAS_VISUAL
+from .data import SESSION_FILE_NAME
+
+
+BIN_SIZE = 0.01
+STIM_BIN = 50
+CONTRASTS = [0, 0.25, 0.5, 1]
+DEFAULT_AREAS = ["VISp", "VISl", "SCs", "MOs", "MOp", "ZI", "CA1", "root"]
+
+
+def constant_rates(rng, num_neurons, num_trials, rate):
+    """Every neuron fires at rate Hz"""
+    return np.full((num_neurons, num_trials), rate)
+
+
+def lognormal_rates(rng, num_neurons, num_trials, rate):
+    """Neurons fire at log-normally distributed rates with a median of rate Hz"""
+    rates = rate * rng.lognormal(0, 0.75, num_neurons)
+    return np.repeat(rates[:, np.newaxis], num_trials, axis=1)
+
+
+def gamma_rates(rng, num_neurons, num_trials, rate):
+    """Log-normal neuron rates with shared gamma-distributed trial-to-trial gain"""
+    gain = rng.gamma(4, 1 / 4, num_trials)
+    return lognormal_rates(rng, num_neurons, num_trials, rate) * gain
+
+
+RATE_MODELS = {
+    "constant": constant_rates,
+    "lognormal": lognormal_rates,
+    "gamma": gamma_rates,
+}
+
+
+def _get_behavior(rng, num_trials, num_bins, motor_latency, latency_jitter, lapse):
+    contrast_left = rng.choice(CONTRASTS, num_trials)
+    contrast_right = rng.choice(CONTRASTS, num_trials)
+
+    # response == -1 is a right choice, 1 a left choice and 0 no response
+    response = np.sign(contrast_left - contrast_right).astype(int)
+    is_guess = (contrast_left == contrast_right) & (contrast_left > 0)
+    response[is_guess] = rng.choice([-1, 1], is_guess.sum())
+    is_lapse = rng.random(num_trials) < lapse
+    response[is_lapse] = rng.choice([-1, 0, 1], is_lapse.sum())
+
+    is_go = response != 0
+    correct_response = np.sign(contrast_left - contrast_right)
+    feedback_type = np.where(
+        (response == correct_response) | (is_guess & is_go), 1, -1
+    ).astype(float)
+
+    # Movement onset, in bins after the stimulus
+    reaction_bins = np.rint(
+        motor_latency + latency_jitter * rng.standard_normal(num_trials)
+    ).astype(int)
+    reaction_bins = np.clip(reaction_bins, 1, num_bins - STIM_BIN - 10)
+
+    reaction_time = np.column_stack(
+        [reaction_bins * BIN_SIZE * 1000.0, -response.astype(float)]
+    )
+    reaction_time[~is_go, 0] = np.inf
+    response_time = (reaction_bins + rng.integers(5, 15, num_trials)) * BIN_SIZE
+    response_time[~is_go] = rng.uniform(1.5, 2, (~is_go).sum())
+
+    # The wheel turns by two units per bin for the ten bins after movement onset
+    # on go trials, and only jitters otherwise
+    bins = np.arange(num_bins) - STIM_BIN - reaction_bins[:, np.newaxis]
+    is_moving = is_go[:, np.newaxis] & (bins >= 0) & (bins < 10)
+    wheel = rng.integers(-1, 2, (num_trials, num_bins)) * (
+        rng.random((num_trials, num_bins)) < 0.005
+    )
+    wheel = wheel + is_moving * (-response[:, np.newaxis] * 2)
+    wheel = np.cumsum(wheel, axis=1).astype(np.int8)
+
+    return (
+        {
+            "contrast_left": contrast_left,
+            "contrast_right": contrast_right,
+            "response": response,
+            "response_time": response_time[:, np.newaxis],
+            "reaction_time": reaction_time,
+            "feedback_type": feedback_type,
+            "feedback_time": response_time[:, np.newaxis] + BIN_SIZE,
+            "gocue": rng.uniform(0.4, 0.8, (num_trials, 1)) + STIM_BIN * BIN_SIZE,
+            "wheel": wheel[np.newaxis],
+        },
+        reaction_bins,
+    )
+
+
+def make_session(
+    num_neurons=300,
+    num_trials=300,
+    num_bins=250,
+    areas=DEFAULT_AREAS,
+    rate_model="lognormal",
+    rate=5.0,
+    visual_latency=8,
+    motor_latency=25,
+    latency_jitter=3,
+    visual_gain=2.0,
+    motor_gain=2.0,
+    lapse=0.1,
+    seed=None,
+):
+    """
+    Generates a session dict with the fields and dtypes of the Steinmetz
+    sessions, with planted visual and motor responses.
+
+    Neurons in AREAS_VISUAL areas increase their firing in proportion to the
+    contrast on their preferred side from visual_latency bins after the
+    stimulus. Neurons in AREAS_ACTION areas increase their firing from movement
+    onset on go trials, which is motor_latency bins after the stimulus on
+    average. Decoders fit on the session should therefore reach their decisions
+    about visual_latency and motor_latency bins after the stimulus.
+
+    Keyword Arguments:
+    num_neurons -- number of neurons
+    num_trials -- number of trials
+    num_bins -- number of 10ms bins per trial, the stimulus is at bin 50
+    areas -- brain areas neurons are drawn from
+    rate_model -- name of the baseline firing rate model in RATE_MODELS
+    rate -- typical baseline firing rate in Hz
+    visual_latency -- bins from the stimulus to the visual response
+    motor_latency -- average bins from the stimulus to movement onset
+    latency_jitter -- standard deviation of movement onset in bins
+    visual_gain -- visual response at full contrast, relative to baseline
+    motor_gain -- motor response, relative to baseline
+    lapse -- fraction of trials with a random response
+    seed -- seed or np.random.Generator
+    """
+    rng = np.random.default_rng(seed)
+    brain_area = rng.choice(areas, num_neurons)
+    session, reaction_bins = _get_behavior(
+        rng, num_trials, num_bins, motor_latency, latency_jitter, lapse
+    )
+
+    baseline = RATE_MODELS[rate_model](rng, num_neurons, num_trials, rate)
+    bins = np.arange(num_bins)
+
+    # Visual neurons respond to the contrast on their preferred side
+    is_visual = np.isin(brain_area, AREAS_VISUAL)
+    contrast = np.where(
+        rng.random(num_neurons)[:, np.newaxis] < 0.5,
+        session["contrast_right"],
+        session["contrast_left"],
+    )
+    visual_response = (bins >= STIM_BIN + visual_latency).astype(float)
+
+    # Motor neurons respond from movement onset on go trials
+    is_motor = np.isin(brain_area, AREAS_ACTION)
+    motor_response = (session["response"] != 0)[:, np.newaxis] & (
+        bins >= STIM_BIN + reaction_bins[:, np.newaxis]
+    )
+
+    spks = np.empty((num_neurons, num_trials, num_bins), dtype=np.uint8)
+    for start in range(0, num_neurons, 64):
+        chunk = slice(start, start + 64)
+        gain = np.ones((len(baseline[chunk]), num_trials, num_bins))
+        gain += (
+            (visual_gain * is_visual[chunk])[:, np.newaxis, np.newaxis]
+            * contrast[chunk, :, np.newaxis]
+            * visual_response
+        )
+        gain += (motor_gain * is_motor[chunk])[:, np.newaxis, np.newaxis] * (
+            motor_response
+        )
+        gain *= baseline[chunk, :, np.newaxis] * BIN_SIZE
+        spks[chunk] = np.minimum(rng.poisson(gain), 255)
+
+    session.update(
+        {
+            "spks": spks,
+            "pupil": rng.normal(size=(3, num_trials, num_bins)).astype(np.float32),
+            "brain_area": np.array(brain_area, dtype=object),
+            "mouse_name": "Synthetic",
+            "date_exp": "2020-01-01",
+            "bin_size": BIN_SIZE,
+            "stim_onset": STIM_BIN * BIN_SIZE,
+            "visual_latency": visual_latency,
+            "motor_latency": motor_latency,
+        }
+    )
+    return session
+
+
+def write_sessions(data_dir, num_sessions=39, sessions_per_file=13, seed=0, **kwargs):
+    """
+    Writes synthetic sessions into data_dir as steinmetz_part*.npz archives, in
+    the format load_sessions reads. A file's sessions are generated just before
+    it is written, so memory use is bounded by sessions_per_file.
+
+    Arguments:
+    data_dir -- directory to write the archives to
+
+    Keyword Arguments:
+    num_sessions -- number of sessions
+    sessions_per_file -- number of sessions per archive
+    seed -- seed of the first session, the others use the following seeds
+    kwargs -- passed to make_session, e.g. num_neurons or rate_model
+    """
+    if type(data_dir) is str:
+        data_dir = Path(data_dir)
+    os.makedirs(data_dir, exist_ok=True)
+
+    for part, start in enumerate(range(0, num_sessions, sessions_per_file)):
+        numbers = range(start, min(start + sessions_per_file, num_sessions))
+        print(f"Writing sessions {numbers[0]}-{numbers[-1]}...")
+        dat = np.array(
+            [make_session(seed=seed + number, **kwargs) for number in numbers],
+            dtype=object,
+        )
+        np.savez(data_dir / f"{SESSION_FILE_NAME}{part}.npz", dat=dat)
+        del dat